@@ -7,8 +7,10 @@ import argparse
 from time import time
 from copy import deepcopy
 from difflib import Differ
+from collections.abc import Mapping
 
 # this doesn't seem to increase speed
+# (and is unsafe with the buffer parse actions, use memo="yes" in the markup)
 #import pyparsing
 #pyparsing.ParserElement.enablePackrat()
  
@@ -18,6 +20,15 @@ def get_filestem(filename):
     stem,ext = os.path.splitext(filename)
     return stem
 
+def json_default(obj):
+    """ Serialize typed columns (NumPy arrays, array.array) as lists,
+        lazy rows as dictionaries """
+    if hasattr(obj,'tolist'):
+        return obj.tolist()
+    if isinstance(obj,Mapping):
+        return dict(obj)
+    raise TypeError('Object of type %s is not JSON serializable'%type(obj).__name__)
+
 def save_data(data,args,filestem=None):
 
     if not filestem:
@@ -27,7 +38,7 @@ def save_data(data,args,filestem=None):
             filestem,_ = os.path.splitext(args.output)
         
     if args.format=='json':
-        outbuf = json.dumps(data,indent=2)
+        outbuf = json.dumps(data,indent=2,default=json_default)
         outfile = filestem+'.json'
         with open(outfile,'w') as f:
             f.write(outbuf)
@@ -124,6 +135,9 @@ def main():
     parser.add_argument('--generate', dest='generate',
         action='store_const', const=True, default=False,
         help='Generate raw text file using XML and data structure')
+
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=2**20,
+        help='Size of the chunks written to file during generation')
         
     parser.add_argument('--verbose', dest='verbose',
         action='store_const', const=True, default=False,
@@ -251,9 +265,9 @@ def main():
         else:
             outfile = args.output
                 
-        buf = tree.generate(data)
+        # stream the output to file chunk by chunk
         with open(outfile,'w') as f:
-            f.write(buf)
+            tree.generate_to(f,data,chunk_size=args.chunk_size)
 
         print('Output saved to',outfile)
             
@@ -1,13 +1,18 @@
 import io
 import re
 import json
+import threading
 #import cPyparsing as pp
 import pyparsing
 
-from copy import deepcopy
 
+from copy import copy
 from functools import reduce
-from itertools import cycle
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+from itertools import cycle, repeat, islice
+from concurrent.futures import ProcessPoolExecutor
 
 # ITERABLE PARSERESULTS?
 #https://stackoverflow.com/questions/26591485/incremental-but-complete-parsing-with-pyparsing
@@ -23,6 +28,14 @@ from itertools import cycle
 
 import xml.etree.ElementTree as ET
 
+from array import array
+
+# NumPy is optional: used for the typed columns, if installed
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 #ParserElement.enablePackrat() # enable caching
 
 #SOL = LineStart()
@@ -36,6 +49,9 @@ VARSPACE = {
     'VERBOSE': False,
     'BREAKPOINTS': False,
     'DEBUG': False,
+    'WORKERS_MIN_ROWS': 10000, # minimal number of rows per worker
+    'KEEP_TOKENS': False, # keep pyparsing results (otherwise suppressed, data goes to buffers)
+    'MEMO_SIZE': 1024, # default bound of the memo caches (memo="yes")
 }
 
 # Set default whitespace characters.
@@ -46,6 +62,33 @@ VARSPACE = {
 def _print(*args):
     if VARSPACE['VERBOSE']: print(*args)
 
+def tracing():
+    """ 
+    Diagnostics (_print, breakpoints) are compiled into the parse actions 
+    and the generation plans only if this is on at the build time.
+    """
+    return bool(VARSPACE['VERBOSE'] or VARSPACE['BREAKPOINTS'])
+
+def keep_tokens():
+    """
+    Pyparsing results are accumulated only if this is on at the build time,
+    otherwise the tokens are suppressed (all data are collected by buffers).
+    """
+    return bool(VARSPACE['KEEP_TOKENS'] or VARSPACE['DEBUG'])
+    
+def build_mode():
+    return tracing(),keep_tokens()
+
+BUILD_LOCK = threading.RLock() # grammars are built one at a time
+BUILDER = {'PARSER':None} # backend of the grammar being built
+WHITE_CHARS = ' \t' # whitespace skipped by the freeparse grammars (no newlines)
+
+def get_parser():
+    """ Backend of the grammar being built (VARSPACE['PARSER'] by default) """
+    return BUILDER['PARSER'] or VARSPACE['PARSER']
+
+LOCAL = threading.local() # context of the running parse call in the thread
+
 class GenerationError(Exception):
     """ Raised when the raw file generation has been failed """
     pass
@@ -53,7 +96,9 @@ class GenerationError(Exception):
 # Custom converting to float
 def convert_to_float(tokens):
     """ intended to be used in pyparsing_common_ only """
-    val = tokens[0]
+    return str_to_float(tokens[0])
+
+def str_to_float(val):
     # DAMN YOU FORTRAN!!!
     try:
         return float(val)
@@ -92,6 +137,7 @@ class Parser:
         self.ZeroOrMore = parser_module.ZeroOrMore
         self.Optional = parser_module.Optional
         self.Group = parser_module.Group
+        self.Suppress = parser_module.Suppress
         self.restOfLine = parser_module.restOfLine
         self.Regex = parser_module.Regex
         self.Combine = parser_module.Combine
@@ -101,25 +147,285 @@ class Parser:
         self.White = parser_module.White
         self.StringEnd = parser_module.StringEnd
         
-        self.SOL = self.LineStart()
-        self.EOL = self.LineEnd()
-        self.EMPTY = self.Empty()
-        self.WHITE = self.White() # not only space, but tab + other whitespace symbols
-        self.WHITESPACE = self.Literal(' ').leaveWhitespace() # only whitespace
-        self.EOF = self.StringEnd()
-        
-        parser_module.ParserElement.setDefaultWhitespaceChars(' \t')
-        
-        class pyparsing_common_(parser_module.pyparsing_common):    
-            sci_real = (
-                self.Regex(r"[+-]?(?:\d+(?:[eEdD][+-]?\d+)|(?:\d+\.\d*|\.\d+)(?:[eEdD][+-]?\d+)?)")
-                    .setName("real number with scientific notation")
-                    .setParseAction(convert_to_float)
-            )
+        with self.building():
+            self.restOfLine = self.restOfLine.copy() # builtin of the module is left as is
+            self.SOL = self.LineStart()
+            if hasattr(self.SOL,'skipper'): # pyparsing 3 skips blank lines at the line start
+                self.SOL.orig_whiteChars = set(WHITE_CHARS)
+                self.SOL.skipper.setWhitespaceChars(WHITE_CHARS)
+            self.EOL = self.LineEnd().setWhitespaceChars(WHITE_CHARS)
+            self.EMPTY = self.Empty()
+            self.WHITE = self.White() # not only space, but tab + other whitespace symbols
+            self.WHITESPACE = self.Literal(' ').leaveWhitespace() # only whitespace
+            self.EOF = self.StringEnd()
+        
+            class pyparsing_common_(parser_module.pyparsing_common):    
+                sci_real = (
+                    self.Regex(r"[+-]?(?:\d+(?:[eEdD][+-]?\d+)|(?:\d+\.\d*|\.\d+)(?:[eEdD][+-]?\d+)?)")
+                        .setName("real number with scientific notation")
+                        .setParseAction(convert_to_float)
+                )
             
         self.ppc = pyparsing_common_ # custom set of parsers
         
+        class Scanner(parser_module.Token):
+            """ 
+            Token delegating the matching to a plain python function
+            scan(instring,loc,doActions) -> (loc,tokens).
+            Used by the tags which walk the input buffer by themselves.
+            """
+            
+            def __init__(self,scan,name=None):
+                super().__init__()
+                self.scan = scan
+                self.mayReturnEmpty = True
+                self.mayIndexError = False
+                if name: self.setName(name)
+                
+            def parseImpl(self,instring,loc,doActions=True):
+                return self.scan(instring,loc,doActions)
+                
+        self.Scanner = Scanner
+        
+        ParseException = parser_module.ParseException
+        
+        class OptionalTransaction(parser_module.ParseElementEnhance):
+            """
+            Optional speculative match: the buffer operations done by 
+            the parse actions of the expression are rolled back if it fails.
+            If given, the expression is not tried when predict(instring,loc)
+            returns None (see make_predictor).
+            """
+            
+            def __init__(self,expr,predict=None):
+                super().__init__(expr)
+                self.predict = predict
+                self.mayReturnEmpty = True
+            
+            def parseImpl(self,instring,loc,doActions=True):
+                predict = self.predict
+                if predict is not None and predict(instring,loc) is None:
+                    return loc,[]
+                if not doActions:
+                    try:
+                        return self.expr._parse(instring,loc,doActions,callPreParse=False)
+                    except (ParseException,IndexError):
+                        return loc,[]
+                journal = LOCAL.context.__journal__
+                savepoint = journal.begin()
+                try:
+                    result = self.expr._parse(instring,loc,doActions,callPreParse=False)
+                except (ParseException,IndexError):
+                    journal.rollback(savepoint)
+                    return loc,[]
+                except:
+                    journal.rollback(savepoint)
+                    raise
+                journal.commit(savepoint)
+                return result
+                
+        class Repeat(parser_module.ParseElementEnhance):
+            """
+            Greedy repetition of the expression from min_ to max_ times
+            (max_=None means unbounded). Each iteration is a transaction:
+            a failed iteration is rolled back from the buffers.
+            If given, stop(instring,loc) is checked before each iteration
+            (at the position after the skipped whitespace), and the loop
+            ends without trying the expression if it returns True.
+            Same for predict(instring,loc) returning None (see make_predictor).
+            If given, count(instring,loc) gives the exact number of repetitions.
+            """
+            
+            def __init__(self,expr,min_=0,max_=None,stop=None,predict=None,count=None):
+                super().__init__(expr)
+                self.min = min_
+                self.max = max_
+                self.stop = stop
+                self.predict = predict
+                self.count = count
+                self.mayReturnEmpty = min_==0 or self.expr.mayReturnEmpty
+                
+            def parseImpl(self,instring,loc,doActions=True):
+                expr_parse = self.expr._parse
+                journal = LOCAL.context.__journal__
+                min_,max_,stop,predict = self.min,self.max,self.stop,self.predict
+                if self.count is not None: min_ = max_ = self.count(instring,loc)
+                preparse = self.expr.preParse
+                tokens = []; n = 0
+                while max_ is None or n<max_:
+                    if stop is not None or predict is not None:
+                        loc_ = preparse(instring,loc)
+                        if stop is not None and stop(instring,loc_): break
+                        if predict is not None and predict(instring,loc_) is None: break
+                    if doActions: savepoint = journal.begin()
+                    try:
+                        loc_,tokens_ = expr_parse(instring,loc,doActions,callPreParse=n>0)
+                    except (ParseException,IndexError):
+                        if doActions: journal.rollback(savepoint)
+                        break
+                    except:
+                        if doActions: journal.rollback(savepoint)
+                        raise
+                    if doActions: journal.commit(savepoint)
+                    n += 1
+                    tokens.extend(tokens_)
+                    if loc_==loc: break # empty match, avoid infinite loop
+                    loc = loc_
+                if n<min_:
+                    raise ParseException(instring,loc,
+                        'expected at least %d repetitions, found %d'%(min_,n),self)
+                return loc,tokens
+                
+        class Choice(parser_module.ParseElementEnhance):
+            """
+            Ordered alternation: the alternatives are tried in turn, each one 
+            is a transaction (see OptionalTransaction), the first match wins.
+            Alternatives with predict(instring,loc) returning None are skipped.
+            If given, table maps the leading literals to the indices of the
+            alternatives: the only alternative which can match is looked up 
+            by the input prefixes of the literal lengths, nothing is tried.
+            """
+            
+            def __init__(self,alternatives,table=None,predicts=None):
+                super().__init__(parser_module.MatchFirst(alternatives))
+                self.table = table
+                self.lengths = sorted({len(key) for key in table}) if table else None
+                self.predicts = predicts or [None]*len(alternatives)
+                self.mayReturnEmpty = any(alt.mayReturnEmpty for alt in alternatives)
+                
+            def parseImpl(self,instring,loc,doActions=True):
+                alternatives = self.expr.exprs
+                table = self.table
+                if table is not None:
+                    start = BLANKS.match(instring,loc).end()
+                    for n in self.lengths:
+                        i = table.get(instring[start:start+n])
+                        if i is not None: 
+                            return alternatives[i]._parse(instring,loc,doActions)
+                    raise ParseException(instring,loc,'no alternative matches',self)
+                if doActions: journal = LOCAL.context.__journal__
+                for alternative,predict in zip(alternatives,self.predicts):
+                    if predict is not None and predict(instring,loc) is None: continue
+                    if doActions: savepoint = journal.begin()
+                    try:
+                        result = alternative._parse(instring,loc,doActions)
+                    except (ParseException,IndexError):
+                        if doActions: journal.rollback(savepoint)
+                        continue
+                    except:
+                        if doActions: journal.rollback(savepoint)
+                        raise
+                    if doActions: journal.commit(savepoint)
+                    return result
+                raise ParseException(instring,loc,'no alternative matches',self)
+                
+        ParseBaseException = parser_module.ParseBaseException
+        
+        class Memo(parser_module.ParseElementEnhance):
+            """
+            Memoized match of a container grammar keyed by the location.
+            The container data of a successful match are snapshotted and
+            installed to the container buffer again on a cache hit, so 
+            the parse actions skipped by the cache leave the same data.
+            Elements with the same signature share the cache of the context.
+            """
+            
+            def __init__(self,expr,slot,signature,maxsize):
+                super().__init__(expr)
+                self.slot = slot
+                self.signature = signature
+                self.maxsize = maxsize
+                
+            def copy(self):
+                cpy = super().copy()
+                cpy.signature = (self.signature,object()) # grammar of copy can differ
+                return cpy
+                
+            def parseImpl(self,instring,loc,doActions=True):
+                if not doActions:
+                    return self.expr._parse(instring,loc,doActions,callPreParse=False)
+                context = LOCAL.context
+                cache = context.memo_cache(self.signature,self.maxsize)
+                buffer = context.__buffers__[self.slot]
+                entry = cache.get(loc)
+                if entry is not None:
+                    cache.move_to_end(loc)
+                    if isinstance(entry,ParseBaseException): raise entry
+                    loc,tokens,data = entry
+                    buffer.restore(copy_data(data))
+                    return loc,tokens.copy()
+                try:
+                    loc_,tokens = self.expr._parse(instring,loc,doActions,callPreParse=False)
+                except ParseBaseException as e:
+                    cache.store(loc,e)
+                    raise
+                cache.store(loc,(loc_,tokens.copy(),copy_data(buffer.__buffer__)))
+                return loc_,tokens
+                
+        class Scope(parser_module.ParseElementEnhance):
+            """
+            Root of the tree grammar: the parse runs in a fresh context
+            (prepared by parse_string, or a default one), which is then 
+            kept by the tree as the last context of the thread.
+            """
+            
+            def __init__(self,expr,tree):
+                super().__init__(expr)
+                self.tree = tree
+                
+            def parseImpl(self,instring,loc,doActions=True):
+                local = self.tree.__local__
+                context = getattr(local,'pending',None) or \
+                    ParseContext(self.tree.__nodes__)
+                local.pending = None
+                previous = getattr(LOCAL,'context',None)
+                LOCAL.context = context
+                try:
+                    return self.expr._parse(instring,loc,doActions,callPreParse=False)
+                finally:
+                    LOCAL.context = previous
+                    local.context = context
+                
+        self.OptionalTransaction = OptionalTransaction
+        self.Repeat = Repeat
+        self.Choice = Choice
+        self.Memo = Memo
+        self.Scope = Scope
+        
         self.pp = parser_module
+        
+    @contextmanager
+    def building(self):
+        """ Context of the grammar construction with this backend """
+        with BUILD_LOCK:
+            parser = BUILDER['PARSER']
+            BUILDER['PARSER'] = self
+            try:
+                yield self
+            finally:
+                BUILDER['PARSER'] = parser
+                
+    def set_whitespace(self,grammar):
+        """
+        Set the whitespace chars of the freeparse grammars (no newlines) 
+        on the elements of the grammar which have the default ones.
+        The explicit settings (leaveWhitespace, LineEnd, White) are kept,
+        the process-wide default of the parser module is not touched.
+        """
+        White = self.White
+        stack = [grammar]; seen = set()
+        while stack:
+            el = stack.pop()
+            if id(el) in seen: continue
+            seen.add(id(el))
+            if el.copyDefaultWhiteChars and not isinstance(el,White):
+                skip = el.skipWhitespace
+                el.setWhitespaceChars(WHITE_CHARS)
+                el.skipWhitespace = skip
+            expr = getattr(el,'expr',None)
+            if expr is not None: stack.append(expr)
+            stack.extend(getattr(el,'exprs',()))
+            stack.extend(el.ignoreExprs)
 
 try:
     import cPyparsing
@@ -151,7 +457,13 @@ class Formatter:
         
         return DISPATCHER_FORMATTERS[formatter_name](tree)
         
-    def __init__(self,tree):
+    @classmethod
+    def create_from_format(cls,fmt,formatter_name=None):
+        """ Create formatter from the format spec only (no tree) """
+        if not formatter_name: formatter_name = 'python_percent'
+        return DISPATCHER_FORMATTERS[formatter_name](None,fmt)
+        
+    def __init__(self,tree,fmt=None):
         raise NotImplementedError
     
     def write(cls,fmt,data):
@@ -159,7 +471,7 @@ class Formatter:
 
 class Formatter_PYTHON_STR(Formatter):
 
-    def __init__(self,tree):
+    def __init__(self,tree,fmt=None):
         self.__tree__ = tree
 
     def write(self,data):
@@ -167,73 +479,386 @@ class Formatter_PYTHON_STR(Formatter):
 
 class Formatter_PYTHON_PERCENT(Formatter):
     
-    def __init__(self,tree):
+    def __init__(self,tree,fmt=None):
         self.__tree__ = tree
-        self.__fmt__ = tree.__xmlroot__.get('format')
+        self.__fmt__ = fmt if fmt else tree.__xmlroot__.get('format')
 
     def write(self,data):
         return self.__fmt__%data
 
 class Formatter_FORTRANFORMAT(Formatter):
 
-    def __init__(self,tree):
+    def __init__(self,tree,fmt=None):
         import fortranformat as ff
         self.__tree__ = tree
-        self.__fmt__ = tree.__xmlroot__.get('format')
+        self.__fmt__ = fmt if fmt else tree.__xmlroot__.get('format')
         self.__writer__ = ff.FortranRecordWriter(self.__fmt__)
 
     def write(self,data):
         return self.__writer__.write([data])
 
 # DATA ITERATOR
+SEQUENCE,MAPPING,SCALAR = 0,1,2
+ITERATOR_KINDS = {list:SEQUENCE,tuple:SEQUENCE,dict:MAPPING}
+
 class DataIterator():
+    """
+    Generation-time cursor over the data structure.
+    Sequences are walked with an integer cursor; for dictionaries the
+    cursor counts the successfully looked up keys (each key of a DICT 
+    is consumed once), so the iterator is empty when cursor reaches size.
+    The parent is the iterator of the enclosing data (see find).
+    """
     
-    def __init__(self,data):
+    __slots__ = ('__data__','__kind__','__size__','__cursor__','__parent__')
+    
+    def __init__(self,data,cursor=0,parent=None):
         self.__data__ = data
-        self.__datatype__ = type(data)
-        self.__vars__ = {}
-        self.__vars__['isempty'] = False        
-        if self.__datatype__ in {list,tuple}:
-            self.__vars__['index'] = 0
-            if len(data)==0: self.__vars__['isempty'] = True
-        elif self.__datatype__ in {dict}:
-            self.__vars__['allkeys'] = set(data.keys())
-            self.__vars__['usedkeys'] = set()
-            #self.__index__ = None
-            if len(data)==0: self.__vars__['isempty'] = True
+        self.__kind__ = kind = ITERATOR_KINDS.get(type(data),SCALAR)
+        self.__size__ = len(data) if kind!=SCALAR else 1
+        self.__cursor__ = cursor
+        self.__parent__ = parent
         
     def next(self,key=None):
-        if self.__datatype__ in {list,tuple}:
-            self.__vars__['index'] += 1
-            if self.__vars__['index']>=len(self.__data__):
-                self.__vars__['isempty'] = True
-                _print('DataIterator.next>>>EMPTY LIST!')
-            return self.__data__[self.__vars__['index']-1]
-        elif self.__datatype__ in {dict}:
-            self.__vars__['usedkeys'].add(key)
-            if not self.__vars__['allkeys'] - self.__vars__['usedkeys']:
-                self.__vars__['isempty'] = True
-                _print('DataIterator.next>>>EMPTY DICT!')
-            return self.__data__[key]
+        kind = self.__kind__
+        if kind==SEQUENCE:
+            self.__cursor__ += 1
+            return self.__data__[self.__cursor__-1]
+        elif kind==MAPPING:
+            value = self.__data__[key]
+            self.__cursor__ += 1
+            return value
         else:
-            raise Exception('unknown type for DataIterator: "%s"'%self.__datatype__)
+            raise Exception('unknown type for DataIterator: "%s"'%type(self.__data__))
             
     def is_empty(self):
-        return self.__vars__['isempty']
+        return self.__cursor__>=self.__size__
+        
+    def exhaust(self):
+        """ Mark all the data as consumed (written by the node as a whole) """
+        self.__cursor__ = self.__size__
+        
+    def is_unused(self):
+        """ True if some keys of the dictionary were not looked up """
+        return self.__kind__==MAPPING and self.__cursor__<self.__size__
         
     def copy(self):
-        obj = DataIterator(self.__data__)
-        obj.__vars__ = deepcopy(self.__vars__)
-        return obj
+        return DataIterator(self.__data__,self.__cursor__,self.__parent__)
+        
+    def find(self,key):
+        """ Value of key in the closest enclosing dictionary (the cursors stay) """
+        it = self
+        while it is not None:
+            if it.__kind__==MAPPING and key in it.__data__:
+                return it.__data__[key]
+            it = it.__parent__
+        raise KeyError(key)
         
     def getall(self):
         return self.__data__
         
     def __repr__(self):
-        return 'DataIterator(type=%s,index=%s)'%(self.__datatype__,self.__vars__.get('index'))
+        return 'DataIterator(type=%s,index=%s)'%(type(self.__data__),self.__cursor__)
+
+# OUTPUT SINK
+class OutputSink:
+    """
+    Shared output for the generation: the tree walk appends chunks,
+    the text is joined once at the end. Savepoints allow discarding the 
+    partial output of the failed optional branches.
+    """
+    
+    def __init__(self):
+        self.__chunks__ = []
+        self.write = self.__chunks__.append
+        
+    def savepoint(self):
+        return len(self.__chunks__)
+        
+    def release(self,savepoint):
+        pass
+        
+    def rollback(self,savepoint):
+        del self.__chunks__[savepoint:]
+        
+    def getvalue(self):
+        return ''.join(self.__chunks__)
+
+class FileSink(OutputSink):
+    """
+    Output sink flushing the chunks to file as soon as their total size 
+    exceeds chunk_size. The savepoints are marks [chunk index,size,file 
+    position]: a flush writes the chunks up to each pending mark and saves
+    its file position, so the rollback of a flushed optional branch 
+    truncates the file. Files which cannot seek are not flushed while 
+    a savepoint is active.
+    """
+    
+    def __init__(self,fileobj,chunk_size=2**20):
+        super().__init__()
+        self.__file__ = fileobj
+        self.__chunk_size__ = chunk_size
+        self.__size__ = 0
+        self.__marks__ = []
+        self.__seekable__ = fileobj.seekable() if hasattr(fileobj,'seekable') else False
+        self.write = self.write_chunk
+        
+    def write_chunk(self,text):
+        self.__chunks__.append(text)
+        self.__size__ += len(text)
+        if self.__size__>=self.__chunk_size__ and (self.__seekable__ or not self.__marks__):
+            self.flush()
+        
+    def savepoint(self):
+        self.__marks__.append([len(self.__chunks__),self.__size__,None])
+        return len(self.__marks__)-1
+        
+    def release(self,savepoint):
+        del self.__marks__[savepoint:]
+        
+    def rollback(self,savepoint):
+        index,size,pos = self.__marks__[savepoint]
+        del self.__marks__[savepoint:]
+        if pos is None:
+            del self.__chunks__[index:]
+            self.__size__ = size
+        else: # the branch has been flushed
+            self.__chunks__.clear()
+            self.__size__ = 0
+            self.__file__.seek(pos)
+            self.__file__.truncate()
+        
+    def flush(self):
+        fileobj,chunks = self.__file__,self.__chunks__
+        start = 0
+        for mark in self.__marks__:
+            if mark[2] is not None: continue
+            fileobj.write(''.join(chunks[start:mark[0]]))
+            start = mark[0]
+            mark[2] = fileobj.tell()
+        fileobj.write(''.join(chunks[start:]))
+        chunks.clear()
+        self.__size__ = 0
+        
+def write_rows(rows,write,nrows=1000):
+    """ Write the row strings to the sink joined by nrows """
+    batch = list(islice(rows,nrows))
+    while batch:
+        write(''.join(batch))
+        batch = list(islice(rows,nrows))
+
+# GENERATION PLAN
+OP_TEXT,OP_FIELD,OP_VALUE,OP_TYPE,OP_GENVAL,OP_ENTER,OP_ENTER_SAME,OP_ENTER_CALL, \
+    OP_LEAVE,OP_TRY,OP_ENDTRY,OP_WHILE,OP_UNTIL,OP_TRACE,OP_CHOICE,OP_JUMP, \
+    OP_EXHAUSTED = range(17)
+
+class GenerationPlan:
+    """
+    Flat instruction list compiled once from the parsing tree.
+    Literal text, type checks, validators and formatters are resolved
+    at compile time; loops and optional branches become jumps, so the 
+    generation runs without the tree recursion and attribute lookups.
+    Instructions:
+        TEXT text                           write constant text
+        FIELD key,type,check,write,tag      take data[key] and write the leaf value
+        VALUE type,check,write,tag          write the current data as leaf value
+        TYPE type,tag                       check the type of the current data
+        GENVAL genval_to,recoverable        fallback to the genval_to method
+        ENTER key                           descend to data[key]
+        ENTER_SAME                          descend keeping the data (aux tags)
+        ENTER_CALL dataiter_next            descend using the dataiter_next method
+        LEAVE                               return to the parent data
+        TRY handler                         start optional branch (savepoint)
+        CHOICE handler                      start alternative (savepoint, data cursor too)
+        ENDTRY                              optional branch or alternative succeeded
+        JUMP target                         jump to target
+        EXHAUSTED tag                       fail if some keys of the descended data are unused
+        WHILE exit                          jump to exit if the data is exhausted
+        UNTIL stop_criteria,target          jump to target unless stopped
+        TRACE message                       print message and data, breakpoint
+    TRACE instructions are only emitted if tracing was on at the compile time.
+    """
+    
+    def __init__(self,tree):
+        self.__code__ = []
+        self.__tracing__ = tracing()
+        tree.compile_plan(self)
+        
+    def emit(self,*instr):
+        self.__code__.append(instr)
+        return len(self.__code__)-1
+        
+    def patch(self,i,*args):
+        """ set arguments of the i-th instruction """
+        self.__code__[i] = self.__code__[i][:1]+args
+        
+    def __len__(self):
+        return len(self.__code__)
+        
+    def run(self,dataiter,sink):
+        code = self.__code__
+        write = sink.write
+        n = len(code)
+        stack = []  # parent iterators
+        frames = [] # active optional branches: (handler,savepoint,depth,iterator,cursor)
+        it = dataiter
+        pc = 0
+        while pc<n:
+            try:
+                while pc<n:
+                    instr = code[pc]; op = instr[0]; pc += 1
+                    if op==OP_TEXT:
+                        write(instr[1])
+                    elif op==OP_FIELD:
+                        _,key,type_,check,fmt,tag = instr
+                        data = it.next(key)
+                        if type(data) is not type_:
+                            raise GenerationError('%s <> %s for %s'%(type_,type(data),tag))
+                        if check is not None: check(data)
+                        write(fmt(data))
+                    elif op==OP_ENTER:
+                        stack.append(it)
+                        it = DataIterator(it.next(instr[1]),0,it)
+                    elif op==OP_LEAVE:
+                        it = stack.pop()
+                    elif op==OP_TYPE:
+                        data = it.__data__
+                        if type(data) is not instr[1]:
+                            raise GenerationError('%s <> %s for %s'%(instr[1],type(data),instr[2]))
+                    elif op==OP_ENTER_SAME:
+                        stack.append(it)
+                    elif op==OP_WHILE:
+                        if it.is_empty(): pc = instr[1]
+                    elif op==OP_UNTIL:
+                        if not instr[1](it): pc = instr[2]
+                    elif op==OP_TRY:
+                        frames.append((instr[1],sink.savepoint(),len(stack),it,None))
+                    elif op==OP_CHOICE:
+                        frames.append((instr[1],sink.savepoint(),len(stack),it,it.__cursor__))
+                    elif op==OP_JUMP:
+                        pc = instr[1]
+                    elif op==OP_EXHAUSTED:
+                        if it is not stack[-1] and it.is_unused():
+                            raise GenerationError('unused keys of %s for %s'%(
+                                sorted(it.__data__),instr[1]))
+                    elif op==OP_ENDTRY:
+                        sink.release(frames.pop()[1])
+                    elif op==OP_VALUE:
+                        _,type_,check,fmt,tag = instr
+                        data = it.__data__
+                        if type(data) is not type_:
+                            raise GenerationError('%s <> %s for %s'%(type_,type(data),tag))
+                        if check is not None: check(data)
+                        write(fmt(data))
+                    elif op==OP_GENVAL:
+                        if instr[2]:
+                            try:
+                                instr[1](it,write)
+                            except GenerationError:
+                                pass
+                        else:
+                            instr[1](it,write)
+                    elif op==OP_ENTER_CALL:
+                        stack.append(it)
+                        it = instr[1](it)
+                    elif op==OP_TRACE:
+                        _print(instr[1],it)
+                        if VARSPACE['BREAKPOINTS']: breakpoint()
+                    else:
+                        raise Exception('unknown plan instruction: %s'%str(instr))
+            except (GenerationError, KeyError):
+                # unwind to the innermost optional branch
+                if not frames: raise
+                pc,savepoint,depth,it,cursor = frames.pop()
+                if cursor is not None: it.__cursor__ = cursor
+                sink.rollback(savepoint)
+                del stack[depth:]
+
+# BUFFER JOURNAL
+MISSING = object() # marks absent dictionary keys in the journal
+
+class Journal:
+    """
+    Undo log of the buffer operations. Operations are logged only inside 
+    transactions (speculative matches of OPTIONAL bodies, LOOP iterations);
+    a failed transaction is rolled back to its savepoint.
+    """
+    
+    __slots__ = ('__log__','__depth__')
+    
+    def __init__(self):
+        self.__log__ = []
+        self.__depth__ = 0
+        
+    def begin(self):
+        self.__depth__ += 1
+        return len(self.__log__)
+        
+    def commit(self,savepoint):
+        self.__depth__ -= 1
+        if not self.__depth__: self.__log__.clear()
+        
+    def rollback(self,savepoint):
+        self.__depth__ -= 1
+        log = self.__log__
+        while len(log)>savepoint:
+            undo,args = log.pop()
+            undo(*args)
+            
+    def log(self,undo,*args):
+        self.__log__.append((undo,args))
+
+class MemoCache(OrderedDict):
+    """
+    LRU cache of the memoized matches keeping at most maxsize 
+    last used entries.
+    """
+    
+    def __init__(self,maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+        
+    def store(self,key,value):
+        self[key] = value
+        if len(self)>self.maxsize: self.popitem(last=False)
+
+class ParseContext:
+    """
+    State of one parsing call: buffers of the tree nodes (indexed by 
+    the node slots), journal of the buffers, memo caches and options.
+    The grammar holds no parsing state, so one tree can serve many threads.
+    """
+    
+    __slots__ = ('__buffers__','__journal__','__memos__','__workers__','__columns__')
+    
+    def __init__(self,nodes,workers=None,columns=None):
+        self.__journal__ = journal = Journal()
+        self.__buffers__ = [node.get_buffer() for node in nodes]
+        for buf in self.__buffers__: buf.__journal__ = journal
+        self.__memos__ = {}
+        self.__workers__ = workers
+        self.__columns__ = columns
+        
+    def memo_cache(self,signature,maxsize):
+        cache = self.__memos__.get(signature)
+        if cache is None:
+            cache = self.__memos__[signature] = MemoCache(maxsize)
+        return cache
+
+def copy_data(data):
+    """ Copy the nested lists and dictionaries (other values are shared) """
+    type_ = type(data)
+    if type_ is dict:
+        return {key:copy_data(val) for key,val in data.items()}
+    elif type_ is list:
+        return [copy_data(val) for val in data]
+    else:
+        return data
 
 class Buffer:
     
+    __journal__ = Journal() # buffers outside the parse contexts never log
+    
     def __init__(self):
         raise NotImplementedError
     
@@ -244,17 +869,30 @@ class Buffer:
         raise NotImplementedError
         
     def clear(self):
+        """ Install a fresh container (data handed out before stay intact) """
         buf = self.__buffer__
         if type(buf) in {list,dict}:
-            buf.clear()
+            self.__buffer__ = type(buf)()
         elif type(buf) is type(None):
             pass
         else:
             raise Exception('Buffer.clear: Unknown buffer type "%s"'%type(buf))
         
     def relocate_buffer(self,key,external_buffer):
+        """ Take over the container of the finished child buffer (no copying) """
         external_data = external_buffer.flush_data()
+        journal = self.__journal__
+        if journal.__depth__: journal.log(external_buffer.undo_flush,external_data)
         self.insert(key,external_data)
+        
+    def undo_flush(self,data):
+        self.__buffer__ = data
+        
+    def restore(self,data):
+        """ Install the container replayed from a memo cache """
+        journal = self.__journal__
+        if journal.__depth__: journal.log(self.undo_flush,self.__buffer__)
+        self.__buffer__ = data
                 
     def pretty_print(self,margin=0):
         s0 = json.dumps(self.__buffer__,indent=2)
@@ -268,13 +906,20 @@ class BufferDict(Buffer):
         self.__buffer__ = {}
     
     def insert(self,key,value):
+        journal = self.__journal__
+        if journal.__depth__: 
+            journal.log(self.undo_insert,key,self.__buffer__.get(key,MISSING))
         self.__buffer__[key] = value
+        
+    def undo_insert(self,key,value):
+        if value is MISSING:
+            del self.__buffer__[key]
+        else:
+            self.__buffer__[key] = value
 
     def flush_data(self):
-        external_data = {}
-        for key in self.__buffer__:
-            external_data[key] = self.__buffer__[key]
-        self.__buffer__.clear()
+        external_data = self.__buffer__
+        self.__buffer__ = {}
         return external_data        
 
 class BufferList(Buffer):
@@ -284,12 +929,21 @@ class BufferList(Buffer):
     
     def insert(self,key,value):
         self.__buffer__.append(value)
+        journal = self.__journal__
+        if journal.__depth__: journal.log(self.undo_extend,1)
+        
+    def extend(self,values):
+        n = len(self.__buffer__)
+        self.__buffer__.extend(values)
+        journal = self.__journal__
+        if journal.__depth__: journal.log(self.undo_extend,len(self.__buffer__)-n)
+        
+    def undo_extend(self,n):
+        if n: del self.__buffer__[-n:]
 
     def flush_data(self):
-        external_data = []
-        for val in self.__buffer__:
-            external_data.append(val)
-        self.__buffer__.clear()
+        external_data = self.__buffer__
+        self.__buffer__ = []
         return external_data        
 
 class BufferStub(Buffer):
@@ -303,6 +957,75 @@ class BufferStub(Buffer):
     def flush_data():
         raise NotImplementedError
 
+def relocation_factory(node):
+    """ Parse action moving the data of the finished container to the parent """
+    slot,parent_slot,key = node.__slot__,node.__parent__.__slot__,node.__varname__
+    def relocate(tokens):
+        buffers = LOCAL.context.__buffers__
+        buffers[parent_slot].relocate_buffer(key,buffers[slot])
+    return relocate
+
+def count_factory(node,name,ParseException):
+    """ Look up the parsed value "name" in the buffers of the node ancestors """
+    slots = []
+    parent = node.__parent__
+    while parent is not None:
+        slots.append(parent.__slot__)
+        parent = parent.__parent__
+    def count(instring,loc):
+        buffers = LOCAL.context.__buffers__
+        for slot in slots:
+            data = buffers[slot].__buffer__
+            if type(data) is dict and name in data:
+                return int(data[name])
+        raise ParseException(instring,loc,'count "%s" is not parsed yet'%name)
+    return count
+
+# FIRST sets: (patterns,nullable), patterns are the regular expressions 
+# of the possible starts of a match, nullable is True if the grammar 
+# can match the empty string; None if unknown (the match is always tried)
+FIRST_EMPTY = (frozenset(),True)
+
+def first_text(txt):
+    """ FIRST set of the literal text of the markup """
+    txt = txt.strip() if txt else None
+    if not txt: return FIRST_EMPTY
+    return frozenset([re.escape(txt)]),False
+
+def first_sequence(firsts):
+    """ FIRST set of a sequence of grammars """
+    patterns = frozenset()
+    for first in firsts:
+        if first is None: return None
+        patterns |= first[0]
+        if not first[1]: return patterns,False
+    return patterns,True
+    
+def first_optional(first):
+    """ FIRST set of a grammar which can be skipped """
+    return None if first is None else (first[0],True)
+
+def first_union(firsts):
+    """ FIRST set of the alternatives """
+    if any(first is None for first in firsts): return None
+    patterns = frozenset().union(*[first[0] for first in firsts])
+    return patterns,any(first[1] for first in firsts)
+
+BLANKS = re.compile('[ \t]*') # whitespace skipped by the lookaheads
+
+def make_predictor(first):
+    """
+    Lookahead of the speculative matches: predict(instring,loc) is None 
+    if no match of the grammar with the FIRST set can start at loc 
+    (the whitespace skipped by the grammar is skipped here as well). 
+    Returns None if the grammar can't be predicted.
+    """
+    if first is None: return None
+    patterns,nullable = first
+    if nullable or not patterns: return None
+    regex = '|'.join('(?:%s)'%pattern for pattern in sorted(patterns))
+    return re.compile(BLANKS.pattern+'(?:%s)'%regex).match
+
 def sum_grammars(*grammars):
     gg = []
     for g in grammars:
@@ -375,6 +1098,8 @@ class ParsingTree:
     GetGrammar method must be redefined by subcasses.
     """
     
+    __recoverable__ = False # True if handle_generation_error doesn't raise
+    
     @classmethod
     def get_buffer(cls):
         raise NotImplementedError
@@ -404,10 +1129,12 @@ class ParsingTree:
         The push method is activated by child every time the 
         parse action trigger is activated.
         """        
-        self.__grammar__ = None
+        self.__grammars__ = {} # built grammars keyed by backend and mode
+        self.__plan__ = None
         self.__parent__ = parent # !!! parent must be container!!!
-        #self.__buffer__ = Buffer()
-        self.__buffer__ = self.__class__.get_buffer()
+        self.__slot__ = None # index of the buffer in parse contexts (set on build)
+        self.__nodes__ = None # all nodes of the tree by slots (set on build)
+        self.__local__ = threading.local() # last parse context in each thread
         self.__xmlroot__ = xmlroot  
         self.__tag__ = xmlroot.tag  
         #self.__text__ = process_text(xmlroot.text)
@@ -456,21 +1183,52 @@ class ParsingTree:
                         
         return grammar_body,grammar_tail
         
+    def get_first(self):
+        """ FIRST set of the node grammar (see first_sequence), None if unknown """
+        return None
+        
+    def get_first_body(self):
+        """ FIRST set of the text and children grammars """
+        firsts = [first_text(self.__text__)]
+        firsts += [el.get_first() for el in self.__children__]
+        return first_sequence(firsts)
+        
+    def get_prefix(self):
+        """ 
+        Leading literal of the node grammar, None if there is no such.
+        It is a guess: the match starts with it only if the FIRST set 
+        of the node is the one of the literal.
+        """
+        text = self.__text__.strip() if self.__text__ else None
+        if text: return text
+        if self.__children__: return self.__children__[0].get_prefix()
+        return None
+        
     def generate(self,data):
         dataiter = DataIterator(data)
-        buf = self.generate_(dataiter)
-        return buf
-        #print('GENERATE:')
-        #print(buf)
-        #buf = [s for s in buf if s]
-        #buf = split_list(buf,'\n')
-        #lines = [' '.join(b) for b in buf]
-        #return '\n'.join(lines)
-    
-    def generate_(self,dataiter):
+        sink = OutputSink()
+        self.plan.run(dataiter,sink)
+        return sink.getvalue()
+        
+    def generate_to(self,fileobj,data,chunk_size=2**20,encoding='utf-8'):
+        """
+        Generate a "raw" file from data structure writing the output
+        incrementally to file (file name or file object) in chunks 
+        of about chunk_size characters.
+        """
+        if type(fileobj) is str:
+            with open(fileobj,'w',encoding=encoding) as f:
+                return self.generate_to(f,data,chunk_size)
+        dataiter = DataIterator(data)
+        sink = FileSink(fileobj,chunk_size)
+        self.plan.run(dataiter,sink)
+        sink.flush()
+    
+    def generate_(self,dataiter,sink):
         """
         Tries to generate a "raw" file from data structure using stored format.
         This is needed to have a full cycle "parse->analyze->substitute->generate".
+        The output is written to the shared sink.
         """
         
         _print('breakpoint ParsingTree.generate_>>>BEGIN:')
@@ -483,8 +1241,7 @@ class ParsingTree:
         _print('ParsingTree.generate_>>>dataiter.getall()',dataiter.getall())
         _print('---------------------------------------------------------------')
         
-        buf = ''
-        #buf = []
+        write = sink.write
         
         #if self.__text__: buf += self.__text__
         #if self.__text__: _print('ParsingTree.generate_>>>self.__text__',self.__text__)
@@ -495,10 +1252,7 @@ class ParsingTree:
             _print('breakpoint ParsingTree.generate_>>>try>>>1:')
             if VARSPACE['BREAKPOINTS']: breakpoint()
             
-            selfbuf = self.genval(dataiter) # -> if tag=FLOAT, STR, INT etc...
-            _print('ParsingTree.generate_>>>selfbuf',selfbuf)
-            buf += selfbuf
-            #buf.append(selfbuf)
+            self.genval_to(dataiter,write) # -> if tag=FLOAT, STR, INT etc...
         except GenerationError:
             
             _print('breakpoint ParsingTree.generate_>>>except>>>1:')
@@ -518,7 +1272,7 @@ class ParsingTree:
                 #text = process_text_(text)
                 #buf += text
                 #buf.append(text)
-                buf += self.__text__
+                write(self.__text__)
             
             if self.__text__: _print('ParsingTree.generate_>>>while>>>self.__text__',self.__text__)
                                                             
@@ -536,28 +1290,31 @@ class ParsingTree:
                                         
                 _print('ParsingTree.generate_>>>while>>>for>>dataiter_child.getall()',dataiter_child.getall())
                 #if not dataiter_child: continue
+                
+                # only the recoverable (optional) children need to discard their partial output
+                if el.__recoverable__: savepoint = sink.savepoint()
                 try:
                     
                     _print('breakpoint ParsingTree.generate_>>>while>>>for>>>try>>>1:')
                     if VARSPACE['BREAKPOINTS']: breakpoint()
                     
                     #elbuf = el.generate_(dataiter_child.copy()) #????
-                    elbuf = el.generate_(dataiter_child) #????
+                    el.generate_(dataiter_child,sink) #????
+                    if el.__recoverable__: sink.release(savepoint)
                     _print('ParsingTree.generate_>>>while>>>for>>try>>dataiter',dataiter)
-                    _print('ParsingTree.generate_>>>while>>>for>>try>>elbuf',elbuf)
-                    buf += elbuf
                     #if dataiter.is_empty(): break
                 except (GenerationError, KeyError):
                     # do something if failed to generate from children (important for "optional" tag)
                     _print('breakpoint ParsingTree.generate_>>>while>>>for>>>except>>>1:')
                     if VARSPACE['BREAKPOINTS']: breakpoint()
+                    if el.__recoverable__: sink.rollback(savepoint)
                     el.handle_generation_error()
 
                 if el.__tail__: 
                     #tail = process_text_(el.__tail__)
                     #buf += tail
                     #buf.append(tail)
-                    buf += el.__tail__
+                    write(el.__tail__)
                 if el.__tail__: _print('ParsingTree.generate_>>>while>>>for>>>el.__tail__',el.__tail__)
                     
             if self.__stop_criteria__(dataiter): break # stopping criteria for each tag
@@ -572,16 +1329,71 @@ class ParsingTree:
         _print('breakpoint ParsingTree.generate_>>>END:')
         if VARSPACE['BREAKPOINTS']: breakpoint()
         
-        return buf
-        
     def __stop_criteria__(self,dataiter):
         return True
         
+    def compile_plan(self,plan):
+        """
+        Append the generation instructions for this node to the plan. 
+        Mirrors generate_: genval, then the passes over the children.
+        """
+        if plan.__tracing__:
+            plan.emit(OP_TRACE,'GenerationPlan>>>%s(%s)'%(self.__tag__,self.__varname__))
+        self.compile_genval(plan)
+        if not self.__children__: return
+        i_while = plan.emit(OP_WHILE,None)
+        if self.__text__: plan.emit(OP_TEXT,self.__text__)
+        for el in self.__children__:
+            el.compile_child(plan)
+        if type(self).__stop_criteria__ is not ParsingTree.__stop_criteria__:
+            plan.emit(OP_UNTIL,self.__stop_criteria__,i_while)
+        plan.patch(i_while,len(plan))
+        
+    def compile_child(self,plan,exhaust=False):
+        """ 
+        Append the instructions for this node as a child, with its tail.
+        If exhaust is True, the node must use all the keys of its data.
+        """
+        field = self.compile_field()
+        if field is not None:
+            plan.emit(OP_FIELD,*field)
+        else:
+            self.compile_enter(plan)
+            if self.__recoverable__:
+                i_try = plan.emit(OP_TRY,None)
+                self.compile_plan(plan)
+                plan.emit(OP_ENDTRY)
+                plan.patch(i_try,len(plan)) # on failure, go to LEAVE
+            else:
+                self.compile_plan(plan)
+            if exhaust: plan.emit(OP_EXHAUSTED,self.__tag__)
+            plan.emit(OP_LEAVE)
+        if self.__tail__: plan.emit(OP_TEXT,self.__tail__)
+        
+    def genval_to(self,dataiter,write):
+        """ Write the output of genval (the tabular tags write it by rows) """
+        buf = self.genval(dataiter)
+        _print('ParsingTree.genval_to>>>buf',buf)
+        write(buf)
+        
+    def compile_genval(self,plan):
+        plan.emit(OP_GENVAL,self.genval_to,self.__recoverable__)
+        
+    def compile_enter(self,plan):
+        if type(self).dataiter_next is ParsingTree.dataiter_next:
+            plan.emit(OP_ENTER,self.__varname__)
+        else:
+            plan.emit(OP_ENTER_CALL,self.dataiter_next)
+            
+    def compile_field(self):
+        """ Arguments for the fused FIELD instruction, None if not applicable """
+        return None
+        
     def dataiter_next(self,dataiter):
         obj = dataiter.next(self.__varname__)
         _print('%s.dataiter_next>>>tag'%self.__class__.__name__,self.__tag__)
         _print('%s.dataiter_next>>>dataiter(before)'%self.__class__.__name__,dataiter)
-        dataiter_child = DataIterator(obj)
+        dataiter_child = DataIterator(obj,0,dataiter)
         _print('%s.dataiter_child.getall()>>>dataiter(after)'%self.__class__.__name__,dataiter_child.getall())
         _print('%s.dataiter_next>>>dataiter(after)'%self.__class__.__name__,dataiter)
         return dataiter_child
@@ -589,37 +1401,97 @@ class ParsingTree:
     def print_tree(self,level=0,show_buffer=False):
         print('\n'+("=="*level),self.__tag__,self.__varname__)
         if show_buffer:
-            self.__buffer__.pretty_print(margin=2*level)
+            self.get_context_buffer().pretty_print(margin=2*level)
         for child in self.__children__:
             child.print_tree(level=level+1,show_buffer=show_buffer)
+            
+    def walk(self):
+        """ Iterate over the nodes of the subtree (depth first) """
+        yield self
+        for el in self.__children__:
+            yield from el.walk()
+            
+    def get_root(self):
+        root = self
+        while root.__parent__ is not None: root = root.__parent__
+        return root
                         
     def insert_to_buffer(self,key,value):
-        self.__buffer__.insert(key,value)
+        LOCAL.context.__buffers__[self.__slot__].insert(key,value)
+        
+    def get_context_buffer(self):
+        """ Buffer of the last parsing by the tree in the current thread """
+        context = getattr(self.get_root().__local__,'context',None)
+        if context is None: return self.get_buffer()
+        return context.__buffers__[self.__slot__]
         
     def clear_buffer(self):
-        """ recursively clear the buffer """
-        self.__buffer__.clear()
-        for el in self.__children__:
-            el.clear_buffer()
+        """ forget the data of the last parsing in the current thread """
+        self.get_root().__local__.context = None
         
     def get_data(self):
-        return self.__buffer__.__buffer__
+        return self.get_context_buffer().__buffer__
     
     @property
     def grammar(self):
-        if not self.__grammar__:
-            self.__grammar__ = self.getGrammar()
-        return self.__grammar__
+        return self.get_grammar()
         
-    def create_grammar(self):
-        self.__grammar__ = self.getGrammar()
+    @property
+    def plan(self):
+        with BUILD_LOCK:
+            if not self.__plan__ or self.__plan__.__tracing__!=tracing():
+                self.__plan__ = GenerationPlan(self)
+        return self.__plan__
+        
+    def get_grammar(self,parser=None):
+        """ Grammar for the backend (VARSPACE['PARSER'] by default) """
+        parser = parser or V['PARSER']
+        grammar = self.__grammars__.get((parser,build_mode()))
+        if grammar is None: grammar = self.create_grammar(parser)
+        return grammar
         
-    def parse_string(self,buf,parse_all=False):
-        self.clear_buffer()
-        #self.grammar.parse_string(buf,parse_all=parse_all)
-        self.grammar.parseString(buf)
+    def create_grammar(self,parser=None):
+        """
+        Build the grammar with the backend (VARSPACE['PARSER'] by default).
+        The grammar is read-only at the parse time: parse actions find
+        the buffers by the node slots in the context of the running parse.
+        """
+        parser = parser or V['PARSER']
+        mode = build_mode()
+        with parser.building():
+            self.__nodes__ = list(self.walk())
+            for slot,node in enumerate(self.__nodes__): node.__slot__ = slot
+            grammar = self.build_grammar()
+            if grammar: 
+                grammar = parser.Scope(grammar,self)
+                parser.set_whitespace(grammar)
+                grammar.streamline() # pyparsing streamlines on the first parse
+            self.__grammars__[(parser,mode)] = grammar
+        return grammar
         
-    def parse_file(self,fileobj,encoding='utf-8',parse_all=False):
+    def parse_string(self,buf,parse_all=False,workers=None,columns=None,parser=None):
+        """
+        Parse the string buffer and return the data. If "workers" is given, 
+        large fixed-column tables are converted in a pool of worker processes.
+        If "columns" is given, only these columns of the fixed-column tables
+        are sliced and converted (list of names, or dictionary of lists
+        keyed by the table names). If "parser" is given, it is used
+        as a backend instead of VARSPACE['PARSER'].
+        The parsing state lives in the context of the call, so the same 
+        tree can parse in many threads at once.
+        """
+        parser = parser or V['PARSER']
+        grammar = self.get_grammar(parser)
+        self.__local__.pending = ParseContext(self.__nodes__,workers,columns)
+        try:
+            #grammar.parse_string(buf,parse_all=parse_all)
+            grammar.parseString(buf)
+        finally:
+            self.__local__.pending = None
+        return self.get_data()
+        
+    def parse_file(self,fileobj,encoding='utf-8',parse_all=False,
+            workers=None,columns=None,parser=None):
         enc = encoding
         if type(fileobj) is str:
             with open(fileobj,encoding=enc) as f:
@@ -628,9 +1500,19 @@ class ParsingTree:
             enc_ = fileobj.encoding
             assert enc_==enc,'%s <> %s'%(enc_,enc)
             buf = fileobj.read()
-        self.parse_string(buf,parse_all=parse_all)
+        return self.parse_string(buf,parse_all=parse_all,workers=workers,
+            columns=columns,parser=parser)
                 
     def getGrammar(self):
+        """
+        Grammar of the node. The root gives the grammar of the tree 
+        (see get_grammar), ready to parse with.
+        """
+        if self.__parent__ is None: return self.get_grammar()
+        return self.build_grammar()
+        
+    def build_grammar(self):
+        """ Build the grammar of the node (at the grammar construction) """
         raise NotImplementedError
 
     def init_grammar(self):
@@ -651,17 +1533,62 @@ class ParsingTreeValue(ParsingTree):
     Abstract class for the "leaves" such as float, int, str etc...
     """    
     
+    __raw_tokens__ = False # True if the leaf action can replace the actions of init_grammar
+    __first__ = None # regex of the possible starts of the match (FIRST set)
+    
     @classmethod
     def get_buffer(cls):
         return BufferStub()
             
     def post_process(self,grammar):
         return grammar
+        
+    def get_first(self):
+        if self.__first__ is None: return None
+        return frozenset([self.__first__]),False
     
-    def getGrammar(self):
+    def make_action(self):
+        """
+        Single parse action converting the token and inserting it 
+        to the parent's buffer (converter and slot are bound here).
+        """
+        type_ = self.get_converter() if self.__raw_tokens__ else self.get_type()
+        if self.__parent__ is None:
+            return lambda tokens: type_(tokens[0])
+        slot = self.__parent__.__slot__
+        key = self.__varname__
+        if not keep_tokens(): # value goes to buffer only
+            if type_ is str:
+                def action(tokens):
+                    LOCAL.context.__buffers__[slot].insert(key,tokens[0])
+                    return []
+            else:
+                def action(tokens):
+                    LOCAL.context.__buffers__[slot].insert(key,type_(tokens[0]))
+                    return []
+        elif type_ is str: # tokens are strings already
+            def action(tokens):
+                LOCAL.context.__buffers__[slot].insert(key,tokens[0])
+        else:
+            def action(tokens):
+                value = type_(tokens[0])
+                LOCAL.context.__buffers__[slot].insert(key,value)
+                return value
+        return action
+    
+    def build_grammar(self):
         
         grammar = self.init_grammar()
-        type_ = self.get_type()
+        
+        if not tracing():
+            # fused action: conversion and insertion in one callback
+            if self.__raw_tokens__:
+                grammar.setParseAction(self.make_action())
+            else:
+                grammar.addParseAction(self.make_action())
+            return self.finalize_grammar(grammar)
+        
+        type_ = self.get_converter() if self.__raw_tokens__ else self.get_type()
         
         # add type conversion
         grammar.addParseAction(lambda tokens: type_(tokens[0]))
@@ -681,6 +1608,10 @@ class ParsingTreeValue(ParsingTree):
             
         grammar.addParseAction(lambda tokens: insert_to_parent(self,tokens[0]))
         
+        return self.finalize_grammar(grammar)
+        
+    def finalize_grammar(self,grammar):
+        
         # take care of the tail text (if present)
         if self.__tail__ is not None:
             tail = self.__tail__.strip()
@@ -734,23 +1665,62 @@ class ParsingTreeValue(ParsingTree):
     def to_str(self,data):
         return str(data)
         
+    def get_converter(self):
+        """ Conversion of the raw token string (see __raw_tokens__) """
+        return self.get_type()
+        
     def check_data(self,data):
         pass
         
+    def compile_check(self):
+        """ Return the data validator (None if there is nothing to check) """
+        if type(self).check_data is ParsingTreeValue.check_data: return None
+        return self.check_data
+        
+    def compile_value(self):
+        try:
+            type_ = self.get_type()
+        except NotImplementedError:
+            return None
+        return type_,self.compile_check(),self.__formatter__.write,self.__tag__
+        
+    def compile_genval(self,plan):
+        value = self.compile_value()
+        if value is None: 
+            return super().compile_genval(plan)
+        plan.emit(OP_VALUE,*value)
+        
+    def compile_field(self):
+        if self.__children__ or self.__recoverable__ or \
+            type(self).dataiter_next is not ParsingTree.dataiter_next: 
+            return None
+        value = self.compile_value()
+        if value is None: return None
+        return (self.__varname__,)+value
+        
 class TreeFLOAT(ParsingTreeValue):
     
+    __raw_tokens__ = True # float() takes the matched string
+    __first__ = r'[+-]?\.?\d'
+    
     def init_grammar(self):
         #return ppc.number()
-        return V['PARSER'].ppc.sci_real()
+        return get_parser().ppc.sci_real()
     
     def get_type(self):
         return float
+        
+    def get_converter(self):
+        return str_to_float # D-exponents
             
 class TreeINT(ParsingTreeValue):
 
+    __raw_tokens__ = True # int() takes the matched string
+    __first__ = r'[+-]?\d'
+
     def init_grammar(self):
         #return ppc.number()
-        return V['PARSER'].ppc.signed_integer()
+        return get_parser().ppc.signed_integer()
     
     def get_type(self):
         return int
@@ -761,9 +1731,11 @@ class TreeNUMBER(ParsingTreeValue):
         'int': int,
         'float': float,
     }
+    
+    __first__ = r'[+-]?\.?\d'
 
     def init_grammar(self):
-        return V['PARSER'].ppc.number()
+        return get_parser().ppc.number()
     
     def get_type(self):
         typ = self.__xmlroot__.get('type')
@@ -774,8 +1746,10 @@ class TreeFORTRAN(TreeNUMBER):
     
     """ Fortran-formatted numbers, e.g. 1.e-10, 1.2-307 etc... """
     
+    __first__ = r'[+-]?[.\d]'
+    
     def init_grammar(self):
-        return V['PARSER'].Regex('[+-]?(?:\.|\d+\.?)\d*([de][+-]?\d+)?(_[a-z\d]+)?')
+        return get_parser().Regex('[+-]?(?:\.|\d+\.?)\d*([de][+-]?\d+)?(_[a-z\d]+)?')
         
     def get_type(self): # TODO!!!
         raise NotImplementedError
@@ -793,7 +1767,7 @@ class TreeBUFFER(ParsingTreeValue):
         if not nchars: raise Exception('BUFFER tag requires "nchars"'
             ' parameter to be supplied')
         nchars = int(nchars)
-        return V['PARSER'].Regex('.{%d}'%nchars).leaveWhitespace()
+        return get_parser().Regex('.{%d}'%nchars).leaveWhitespace()
     
     def get_type(self):
         typ = self.__xmlroot__.get('type')
@@ -802,8 +1776,10 @@ class TreeBUFFER(ParsingTreeValue):
 
 class TreeSTR(ParsingTreeValue):
 
+    __first__ = r'\S'
+
     def init_grammar(self):
-        return V['PARSER'].Word(V['PARSER'].printables)
+        return get_parser().Word(get_parser().printables)
     
     def get_type(self):
         return str
@@ -814,16 +1790,30 @@ class TreeLITERAL(ParsingTreeValue):
         inp = self.__xmlroot__.get('input')
         if not inp: raise Exception('LITERAL tag must '
                 'have "input" parameter specified')
-        return V['PARSER'].Literal(inp)
+        return get_parser().Literal(inp)
     
     def get_type(self):
         return str
+        
+    def get_first(self):
+        return first_text(self.__xmlroot__.get('input'))
+        
+    def get_prefix(self):
+        inp = self.__xmlroot__.get('input')
+        return inp.strip() if inp else None
 
     def check_data(self,data):
         inp = self.__xmlroot__.get('input')
         if inp != data:
             raise GenerationError('"%s" <> "%s" for %s'%(inp,data,self.__tag__))
 
+    def compile_check(self):
+        inp = self.__xmlroot__.get('input'); tag = self.__tag__
+        def check(data):
+            if inp != data:
+                raise GenerationError('"%s" <> "%s" for %s'%(inp,data,tag))
+        return check
+
 class TreeWORD(ParsingTreeValue):
 
     def init_grammar(self):
@@ -831,21 +1821,36 @@ class TreeWORD(ParsingTreeValue):
         #if not inp: inp = printables
         #if not inp: inp = pyparsing_unicode.printables
         #if not inp: inp = pp.unicode.printables
-        if not inp: inp = V['PARSER'].pp.unicode.printables
-        return V['PARSER'].Word(inp)
+        if not inp: inp = get_parser().pp.unicode.printables
+        return get_parser().Word(inp)
     
     def get_type(self):
         return str
+        
+    def get_first(self):
+        inp = self.__xmlroot__.get('input')
+        pattern = '[%s]'%re.escape(inp) if inp else r'\S'
+        return frozenset([pattern]),False
 
     def check_data(self,data):
         inp = self.__xmlroot__.get('input')
+        if inp is None: return # any printables
         if not set(data).issubset(inp):
             raise GenerationError('"%s" is not a word of "%s" for %s'%(data,inp,self.__tag__))
 
+    def compile_check(self):
+        inp = self.__xmlroot__.get('input'); tag = self.__tag__
+        if inp is None: return None
+        chars = frozenset(inp)
+        def check(data):
+            if not chars.issuperset(data):
+                raise GenerationError('"%s" is not a word of "%s" for %s'%(data,inp,tag))
+        return check
+
 class TreeRESTOFLINE(ParsingTreeValue):
     
     def init_grammar(self):
-        return V['PARSER'].restOfLine()
+        return get_parser().restOfLine()
     
     def get_type(self):
         return str
@@ -861,50 +1866,301 @@ class TreeREGEX(ParsingTreeValue):
         regex = self.__xmlroot__.get('input')
         if not regex: 
             raise Exception('regex is empty')
-        return V['PARSER'].Regex(regex)
+        return get_parser().Regex(regex)
     
     def get_type(self):
         return str
         
     def post_process(self,grammar):
-        return V['PARSER'].Group(grammar)
+        return get_parser().Group(grammar)
 
     def check_data(self,data):
         regex = self.__xmlroot__.get('input')
         if not re.match(regex,data):
             raise GenerationError('regex(%s) for %s not matched: "%s"'%(regex,self.__tag__,data))
 
+    def compile_check(self):
+        regex = self.__xmlroot__.get('input'); tag = self.__tag__
+        match = re.compile(regex).match
+        def check(data):
+            if not match(data):
+                raise GenerationError('regex(%s) for %s not matched: "%s"'%(regex,tag,data))
+        return check
+
+def text_scanner_factory(begin,end,nth,maxlen,ParseException):
+    """
+    Capture the text from begin up to the nth occurrence of end 
+    (the last one if nth is None) found within maxlen characters 
+    from the start (unbounded if None). begin and end are regular 
+    expressions, plain texts are searched with str.find.
+    """
+    if re.escape(begin)==begin:
+        def match_begin(instring,loc):
+            return loc+len(begin) if instring.startswith(begin,loc) else -1
+    else:
+        regex_begin = re.compile(begin).match
+        def match_begin(instring,loc):
+            m = regex_begin(instring,loc)
+            return m.end() if m else -1
+    if re.escape(end)==end:
+        def find_ends(instring,pos,endpos):
+            while True:
+                i = instring.find(end,pos,endpos)
+                if i<0: return
+                pos = i+len(end)
+                yield pos
+    else:
+        regex_end = re.compile(end)
+        def find_ends(instring,pos,endpos):
+            for m in regex_end.finditer(instring,pos,endpos): 
+                yield m.end()
+    def scan(instring,loc,doActions=True):
+        pos = match_begin(instring,loc)
+        if pos<0: raise ParseException(instring,loc,'"%s" expected'%begin)
+        endpos = len(instring) if maxlen is None else min(len(instring),loc+maxlen)
+        found = -1
+        for n,found in enumerate(find_ends(instring,pos,endpos),1):
+            if n==nth: break
+        else:
+            if nth is not None: found = -1
+        if found<0: raise ParseException(instring,loc,'"%s" not found'%end)
+        return found,[instring[loc:found]]
+    return scan
+
 class TreeTEXT(ParsingTreeValue):
+    """
+    Text block from "begin" up to "end" (regular expressions).
+    Attributes:
+        nth    - number of the "end" occurrence closing the block 
+                 (default 1, the nearest one) or "last"
+        maxlen - maximal length of the block (unbounded by default)
+    """
 
-    def init_grammar(self):
+    def make_scan(self):
+        """ Matching function of the Scanner (see text_scanner_factory) """
         begin = self.__xmlroot__.get('begin')
         end = self.__xmlroot__.get('end')
         if not (begin and end): 
             raise Exception('text should have both "begin" and "end" fields')
-        regex = begin+'[\s\S]*'+end
-        return V['PARSER'].Regex(regex)
+        nth = (self.__xmlroot__.get('nth') or '1').lower()
+        nth = None if nth=='last' else int(nth)
+        maxlen = self.__xmlroot__.get('maxlen')
+        maxlen = int(maxlen) if maxlen else None
+        return text_scanner_factory(begin,end,nth,maxlen,
+            get_parser().pp.ParseException) # produce with factory (proper closures!!)
+
+    def init_grammar(self):
+        return get_parser().Scanner(self.make_scan(),'TEXT')
     
     def get_type(self):
         return str
 
     def post_process(self,grammar):
-        return V['PARSER'].Group(grammar)
+        return get_parser().Group(grammar)
 
-    def check_data(self,data):        
-        begin = self.__xmlroot__.get('begin')
-        end = self.__xmlroot__.get('end')
-        if not (begin and end): 
-            raise Exception('text should have both "begin" and "end" fields')
-        regex = begin+'[\s\S]*'+end        
-        if not re.match(regex,data):
-            raise GenerationError('regex(%s) for %s not matched: "%s"'%(regex,self.__tag__,data))
+    def check_data(self,data):
+        self.compile_check()(data)
+
+    def compile_check(self):
+        """ The block must be scanned back whole (same begin, end, nth, maxlen) """
+        scan = self.make_scan(); tag = self.__tag__
+        ParseException = get_parser().pp.ParseException
+        def check(data):
+            try:
+                found = scan(data,0)[0]
+            except ParseException:
+                found = -1
+            if found!=len(data):
+                raise GenerationError('%s block is not scanned back whole: "%s"'%(tag,data))
+        return check
+
+def make_matrix(size,type_=float):
+    """ Preallocated square matrix: NumPy array if installed, nested lists otherwise """
+    if np: return np.zeros((size,size),dtype=np.int64 if type_ is int else float)
+    return [[type_(0)]*size for _ in range(size)]
+
+def mirror_matrix(matrix,triangle):
+    """ Fill the missing triangle of the symmetric matrix in place """
+    size = len(matrix)
+    for k in range(size):
+        if np and isinstance(matrix,np.ndarray):
+            if triangle=='lower':
+                matrix[k,k+1:] = matrix[k+1:,k]
+            else:
+                matrix[k+1:,k] = matrix[k,k+1:]
+        else:
+            for j in range(k+1,size):
+                if triangle=='lower':
+                    matrix[k][j] = matrix[j][k]
+                else:
+                    matrix[j][k] = matrix[k][j]
+
+def matrix_scanner_factory(size,triangle,convert,type_,ParseException):
+    """
+    Scan the square matrix printed in blocks of columns: each block starts 
+    with the header of the column indices followed by the rows 
+    "index value value ...". With triangle="lower" ("upper") only the values 
+    on and below (above) the diagonal are printed. The values are stored 
+    to the preallocated matrix, except the first block rows if the size 
+    is not given (the size is the number of these rows then).
+    """
+    def count(row,c0,c1): # number of the row values in the block c0..c1
+        if triangle=='lower': return min(row,c1)-c0+1
+        if triangle=='upper': return c1-max(row,c0)+1
+        return c1-c0+1
+    def scan(instring,loc,doActions=True):
+        start = loc
+        end = len(instring)
+        n = size; matrix = None
+        pending = [] # first block rows while the size is unknown
+        base = c0 = c1 = row = last = None
+        while loc<end:
+            if last is not None and row>last and c1==base+n-1: break # all blocks read
+            i = instring.find('\n',loc)
+            if i<0: i = end
+            fields = instring[loc:i].split()
+            if not fields: break
+            # next row of the block
+            if c0 is not None and (last is None or row<=last) and \
+                    len(fields)==count(row,c0,c1)+1 and fields[0]==str(row):
+                try:
+                    values = list(map(convert,fields[1:]))
+                except ValueError:
+                    break
+                k = (max(row,c0) if triangle=='upper' else c0)-base
+                if matrix is None:
+                    pending.append((row-base,k,values))
+                else:
+                    matrix[row-base][k:k+len(values)] = values
+                row += 1; loc = i+1
+                continue
+            # header of the next block
+            if not all(field.isdigit() for field in fields): break
+            cols = list(map(int,fields))
+            if cols!=list(range(cols[0],cols[0]+len(cols))): break
+            if c1 is None:
+                base = cols[0]
+            else:
+                if cols[0]!=c1+1: break
+                if n is None: n = row-base # size from the first block
+                if last is None: last = base+n-1
+                if row<=last: break # incomplete block
+            if n is not None and cols[-1]>base+n-1: break
+            if n is not None and matrix is None:
+                matrix = make_matrix(n,type_)
+                for j,k,values in pending: matrix[j][k:k+len(values)] = values
+            c0,c1 = cols[0],cols[-1]
+            row = c0 if triangle=='lower' else base
+            if n is not None: last = c1 if triangle=='upper' else base+n-1
+            loc = i+1
+        if c0 is None:
+            raise ParseException(instring,start,'matrix header expected')
+        if n is None: n = row-base
+        if matrix is None:
+            matrix = make_matrix(n,type_)
+            for j,k,values in pending: matrix[j][k:k+len(values)] = values
+        last = c1 if triangle=='upper' else base+n-1
+        if c1!=base+n-1 or row<=last:
+            raise ParseException(instring,min(loc,end),'incomplete matrix')
+        if triangle: mirror_matrix(matrix,triangle)
+        return min(loc,end),[matrix]
+    return scan
+
+class TreeMATRIX(ParsingTreeValue):
+    """
+    Dense square matrix printed in blocks of columns, each block with 
+    the header of the column indices (see matrix_scanner_factory).
+    The matrix is NumPy array if NumPy is installed, nested lists otherwise;
+    both are accepted in generation.
+    Attributes:
+        type     - "float" (default) or "int"
+        triangle - "lower" or "upper" for the symmetric matrices printed 
+                   by one triangle, "full" otherwise (default)
+        size     - matrix size (required for the upper triangle)
+        columns  - number of columns per block in generation (default 5)
+        format   - format of the matrix elements in generation
+    """
+    
+    __raw_tokens__ = True # the scanner returns the matrix itself
+    __first__ = r'\d'
+    
+    TYPES = {
+        'int': int,
+        'float': float,
+    }
+    
+    def __init__(self,xmlroot,parent=None):
+        super().__init__(xmlroot,parent)
+        fmt = xmlroot.get('format')
+        self.__element__ = Formatter.create_from_format(fmt,
+            xmlroot.get('formatter')).write if fmt else str
+        self.__formatter__ = Formatter_PYTHON_STR(self) # whole matrix goes to to_str
+        
+    def get_triangle(self):
+        triangle = (self.__xmlroot__.get('triangle') or 'full').lower()
+        if triangle not in ('full','lower','upper'):
+            raise Exception('MATRIX tag: unknown triangle "%s"'%triangle)
+        return None if triangle=='full' else triangle
+        
+    def get_element_type(self):
+        typ = self.__xmlroot__.get('type')
+        if typ: return self.__class__.TYPES[typ.lower()]
+        return float
+
+    def init_grammar(self):
+        size = self.__xmlroot__.get('size')
+        size = int(size) if size else None
+        triangle = self.get_triangle()
+        if triangle=='upper' and size is None: raise Exception('MATRIX tag'
+            ' with triangle="upper" requires "size" parameter to be supplied')
+        type_ = self.get_element_type()
+        convert = str_to_float if type_ is float else type_ # D-exponents
+        scan = matrix_scanner_factory(size,triangle,convert,type_,
+            get_parser().pp.ParseException) # produce with factory (proper closures!!)
+        return get_parser().Scanner(scan,'MATRIX').leaveWhitespace()
+    
+    def get_type(self):
+        return np.ndarray if np else list
+        
+    def get_converter(self):
+        return lambda matrix: matrix
+        
+    def iter_rows(self,matrix):
+        """ Lines of the column blocks of the matrix """
+        rows = matrix.tolist() if hasattr(matrix,'tolist') else matrix
+        size = len(rows)
+        triangle = self.get_triangle()
+        width = int(self.__xmlroot__.get('columns') or 5)
+        write = self.__element__
+        for c0 in range(0,size,width):
+            c1 = min(c0+width,size)-1
+            yield ' '.join([str(c+1) for c in range(c0,c1+1)])+'\n'
+            for r in range(c0 if triangle=='lower' else 0, c1+1 if triangle=='upper' else size):
+                k0 = max(r,c0) if triangle=='upper' else c0
+                k1 = min(r,c1) if triangle=='lower' else c1
+                yield ' '.join([str(r+1)]+[write(v) for v in rows[r][k0:k1+1]])+'\n'
+        
+    def to_str(self,matrix):
+        return ''.join(self.iter_rows(matrix))
+        
+    def genval_to(self,dataiter,write):
+        data = dataiter.getall()
+        if type(data) is not list and type(data) is not self.get_type(): # lists come from JSON
+            raise GenerationError('%s <> %s for %s'%(self.get_type(),type(data),self.__tag__))
+        write_rows(self.iter_rows(data),write)
+        
+    def compile_genval(self,plan):
+        plan.emit(OP_GENVAL,self.genval_to,self.__recoverable__)
+        
+    def compile_field(self):
+        return None # written by rows (see genval_to)
 
 class ParsingTreeContainer(ParsingTree):
     """
     Abstract class for container tags (list, loop, dict).
     """    
 
-    def getGrammar(self):
+    def build_grammar(self):
                 
         grammar_body,grammar_tail = self.collect_grammar_from_children()        
         
@@ -913,10 +2169,15 @@ class ParsingTreeContainer(ParsingTree):
         # attach a trigger to group, if parent is not None
         if self.__parent__ is not None:                    
             
+            memo = self.get_memo()
+            if memo is not None and grammar:
+                grammar = get_parser().Memo(grammar,self.__slot__,*memo)
+            
             def move_to_parent(self):
                 parent = self.__parent__ 
                 key = self.__varname__
-                buf = self.__buffer__
+                buffers = LOCAL.context.__buffers__
+                buf = buffers[self.__slot__]
                 _print('============================')
                 _print('move_to_parent>>>self.__tag__',self.__tag__)
                 _print('move_to_parent>>>parent.__tag__',parent.__tag__)
@@ -924,11 +2185,18 @@ class ParsingTreeContainer(ParsingTree):
                 _print('move_to_parent>>>key',key)
                 _print('move_to_parent>>>buf',buf.__buffer__)
                 _print('============================')
-                parent.__buffer__.relocate_buffer(key,buf)
+                buffers[parent.__slot__].relocate_buffer(key,buf)
             
-            grammar = V['PARSER'].Group(grammar) # without this nested structures work badly
+            # without this nested structures work badly
+            if keep_tokens():
+                grammar = get_parser().Group(grammar)
+            else:
+                grammar = get_parser().Suppress(grammar)
             
-            grammar.setParseAction(lambda tokens: move_to_parent(self))
+            if tracing():
+                grammar.setParseAction(lambda tokens: move_to_parent(self))
+            else:
+                grammar.setParseAction(relocation_factory(self))
                 
         _print('ParsingTreeContainer.getGrammar>>>self.__tag__',self.__tag__)
         _print('ParsingTreeContainer.getGrammar>>>self.__varname__',self.__varname__)
@@ -940,6 +2208,37 @@ class ParsingTreeContainer(ParsingTree):
 
         return grammar
 
+    def get_memo(self):
+        """
+        Memo cache signature and size of the container, if enabled by 
+        the "memo" attribute of the container or of its closest ancestor
+        having it. The attribute value is "yes" (default size), "no", 
+        or the cache size. Containers with equal markup (up to the names) 
+        share the cache. Containers with the loops counted by the values 
+        parsed outside (count="@name") are not memoized.
+        """
+        if any((el.__xmlroot__.get('count') or '').startswith('@') for el in self.walk()):
+            return None
+        node = self
+        while node is not None:
+            memo = node.__xmlroot__.get('memo')
+            if memo is not None: break
+            node = node.__parent__
+        else:
+            return None
+        if memo.lower() in ('yes','true'):
+            maxsize = VARSPACE['MEMO_SIZE']
+        elif memo.lower() in ('no','false'):
+            maxsize = 0
+        else:
+            maxsize = int(memo)
+        if maxsize<=0: return None
+        xmlroot = copy(self.__xmlroot__)
+        xmlroot.tail = self.__tail__.strip() if self.__tail__ else None
+        xmlroot.attrib = {key:val for key,val in xmlroot.attrib.items() 
+            if key not in ('name','memo')}
+        return ET.tostring(xmlroot),maxsize
+
     def genval(self,dataiter):
         data = dataiter.getall()
         _print('%s.genval>>>tag'%self.__class__.__name__,self.__tag__)
@@ -952,6 +2251,12 @@ class ParsingTreeContainer(ParsingTree):
         buf = ''
         return buf
         
+    def compile_genval(self,plan):
+        plan.emit(OP_TYPE,self.get_type(),self.__tag__)
+        
+    def get_first(self):
+        return first_sequence([self.get_first_body(),first_text(self.__tail__)])
+        
 class TreeDICT(ParsingTreeContainer):
     """ Dictionary """
     
@@ -1010,18 +2315,80 @@ class TreeLOOP(ParsingTreeContainer):
     #    grammar_body = ZeroOrMore(grammar_body)
     #    return sum_grammars(grammar_body,grammar_tail)
     def process(self,grammar_body,grammar_tail):
+        miniter,maxiter = self.get_range()
+        # each iteration is rolled back from buffers if it fails
+        grammar_body = get_parser().Repeat(grammar_body,miniter,maxiter,
+            self.get_stop(),make_predictor(self.get_first_body()),self.get_count())
+        return sum_grammars(grammar_body,grammar_tail)
+        
+    def get_range(self):
+        """ Minimal and maximal (None if unbounded) number of iterations """
+        count = self.__xmlroot__.get('count')
+        if count and not count.startswith('@'):
+            return int(count),int(count)
+        if count: # known at parsing only
+            return 0,None
         miniter = self.__xmlroot__.get('min')
         if not miniter: 
-            miniter = ...
+            miniter = 0
         else:
             miniter = int(miniter)
         maxiter = self.__xmlroot__.get('max')
         if not maxiter: 
-            maxiter = ...
+            maxiter = None
         else:
             maxiter = int(maxiter)
-        grammar_body = grammar_body[miniter,maxiter]
-        return sum_grammars(grammar_body,grammar_tail)
+        return miniter,maxiter
+        
+    def get_first(self):
+        first = self.get_first_body()
+        if self.get_range()[0]==0: first = first_optional(first)
+        return first_sequence([first,first_text(self.__tail__)])
+
+    def get_count(self):
+        """
+        Number of iterations taken from the value parsed before the loop
+        (attribute count="@name"), looked up in the enclosing containers.
+        Returns count(instring,loc) for Repeat, None if not applicable.
+        """
+        count = self.__xmlroot__.get('count')
+        if not count or not count.startswith('@'): return None
+        return count_factory(self,count[1:],get_parser().pp.ParseException)
+        
+    def dataiter_next(self,dataiter):
+        dataiter_child = super().dataiter_next(dataiter)
+        count = self.__xmlroot__.get('count')
+        if count is None: return dataiter_child
+        if count.startswith('@'):
+            try:
+                count = dataiter.find(count[1:])
+            except KeyError:
+                raise GenerationError('count %s of %s is not in the data'%(count,self.__tag__))
+        if type(dataiter_child.__data__) is list and len(dataiter_child.__data__)!=int(count):
+            raise GenerationError('%d items <> count %s for %s'%(
+                len(dataiter_child.__data__),count,self.__tag__))
+        return dataiter_child
+        
+    def compile_enter(self,plan):
+        if self.__xmlroot__.get('count') is None:
+            plan.emit(OP_ENTER,self.__varname__)
+        else:
+            plan.emit(OP_ENTER_CALL,self.dataiter_next)
+
+    def get_stop(self):
+        """
+        Terminator of the loop: text (attribute "until") or regular 
+        expression (attribute "until_regex") ending the loop when found
+        at the start of the next iteration. The terminator is not consumed.
+        """
+        until = self.__xmlroot__.get('until')
+        if until:
+            return lambda instring,loc: instring.startswith(until,loc)
+        until_regex = self.__xmlroot__.get('until_regex')
+        if until_regex:
+            match = re.compile(until_regex).match
+            return lambda instring,loc: match(instring,loc) is not None
+        return None
 
     def get_type(self):
         return list
@@ -1036,6 +2403,276 @@ class TreeLOOP(ParsingTreeContainer):
     #        _print('TreeLOOP.get_data_generator>>>datum',datum)
     #        yield el,datum
 
+def keyval_scanner_factory(slot,regex,fields,keep,ParseException):
+    """
+    Scan the "key = value" lines until the first line not matching regex.
+    fields maps the keys to (name,converter) of the declared values.
+    """
+    match = re.compile(regex).match
+    def scan(instring,loc,doActions=True):
+        end = len(instring)
+        items = []
+        while loc<end:
+            i = instring.find('\n',loc)
+            if i<0: i = end
+            m = match(instring,loc,i)
+            if m is None: break
+            key,value = m.group(1).strip(),m.group(2).strip()
+            field = fields.get(key)
+            if field is not None:
+                name,convert = field
+                try:
+                    items.append((name,convert(value)))
+                except ValueError:
+                    raise ParseException(instring,loc,
+                        'invalid value "%s" for key "%s"'%(value,key))
+            elif keep:
+                items.append((key,value))
+            loc = i+1
+        if doActions:
+            buf = LOCAL.context.__buffers__[slot]
+            for name,value in items: buf.insert(name,value)
+        return min(loc,end),[]
+    return scan
+
+def table_scanner_factory(slot,fields,delimiter,output):
+    """
+    Scan the table lines having one field per column until the first line
+    with another number of fields or failing to convert.
+    fields are the (name,type,converter) of the columns.
+    """
+    ncols = len(fields)
+    names = [name for name,_,_ in fields]
+    def scan(instring,loc,doActions=True):
+        end = len(instring)
+        start = loc
+        rows = []
+        append = rows.append
+        while loc<end:
+            i = instring.find('\n',loc)
+            if i<0: i = end
+            row = instring[loc:i].split(delimiter)
+            if len(row)!=ncols: break
+            append(row)
+            loc = i+1
+        values,nrows = convert_table(rows,fields)
+        if nrows<len(rows): # the table ends before the failed row
+            loc = start
+            for _ in range(nrows): loc = instring.find('\n',loc)+1
+        if doActions:
+            buf = LOCAL.context.__buffers__[slot]
+            if output=='columns':
+                for (name,type_,_),vals in zip(fields,values):
+                    buf.insert(name,make_column(vals,None,type_))
+            else:
+                buf.extend([dict(zip(names,row)) for row in zip(*values)])
+        return min(loc,end),[]
+    return scan
+
+def convert_table(rows,fields):
+    """
+    Convert the split table rows column by column.
+    Returns the lists of the column values and the number of converted rows:
+    the table is cut before the first row failing to convert.
+    """
+    columns = list(zip(*rows)) if rows else [()]*len(fields)
+    nrows = len(rows)
+    values = []
+    for (_,_,convert),col in zip(fields,columns):
+        if len(col)>nrows: col = col[:nrows]
+        try:
+            vals = list(map(convert,col))
+        except ValueError:
+            vals = []
+            for s in col:
+                try:
+                    vals.append(convert(s))
+                except ValueError:
+                    break
+            nrows = len(vals)
+        values.append(vals)
+    return [vals[:nrows] for vals in values],nrows
+
+class ParsingTreeScanned(ParsingTreeContainer):
+    """
+    Abstract class for the containers parsed by a single Scanner 
+    (see make_scan) and generated by genval only.
+    Children are the named value tags declaring the fields.
+    """
+    
+    __fields__ = None # compiled values of the fields (see get_fields)
+    
+    def get_values(self):
+        for el in self.__children__:
+            if not isinstance(el,ParsingTreeValue) or not el.__varname__:
+                raise Exception('%s tag accepts only named value tags,'
+                    ' got %s'%(self.__tag__,el.__tag__))
+        return self.__children__
+        
+    def get_fields(self):
+        """ {name:(key,type,check,write,tag)} of the fields, compiled once """
+        fields = self.__fields__
+        if fields is None:
+            fields = self.__fields__ = {el.__varname__:(self.get_key(el),)+el.compile_value() 
+                for el in self.get_values()}
+        return fields
+        
+    def get_key(self,el):
+        return el.__varname__
+        
+    def make_scan(self):
+        """ Matching function of the Scanner (see Parser.Scanner) """
+        raise NotImplementedError
+        
+    def collect_grammar_from_children(self):
+        scan = self.make_scan()
+        grammar_body = get_parser().Scanner(scan,self.__tag__).leaveWhitespace()
+        text = self.__text__.strip() if self.__text__ else None
+        grammar_body = sum_grammars(text,grammar_body)
+        tail = self.__tail__.strip() if self.__tail__ else None
+        return grammar_body,tail
+        
+    def process(self,grammar_body,grammar_tail):
+        return sum_grammars(grammar_body,grammar_tail)
+        
+    def get_first(self):
+        return first_sequence([first_text(self.__text__),None])
+        
+    def generate_(self,dataiter,sink):
+        self.genval_to(dataiter,sink.write)
+        
+    def compile_plan(self,plan):
+        if plan.__tracing__:
+            plan.emit(OP_TRACE,'GenerationPlan>>>%s(%s)'%(self.__tag__,self.__varname__))
+        plan.emit(OP_GENVAL,self.genval_to,False)
+
+class TreeKEYVAL(ParsingTreeScanned):
+    """
+    Section of "key = value" lines in arbitrary order, one pass per line.
+    Children are the value tags of the known keys: the key is the "key" 
+    attribute of a child (defaults to its name), the value is converted 
+    by its type. Attributes:
+        sep       - separator text (default "=")
+        sep_regex - regular expression of the separator used in parsing 
+                    instead of sep (sep is then required for generation)
+        unknown   - "keep" the values of the undeclared keys as strings 
+                    (default) or "drop" them
+    The section ends at the first line without a separator.
+    """
+    
+    def __init__(self,xmlroot,parent=None):
+        super().__init__(xmlroot,parent)
+        if xmlroot.get('sep_regex') is not None and xmlroot.get('sep') is None:
+            raise Exception('KEYVAL tag: sep_regex requires sep for the output')
+    
+    @classmethod
+    def get_buffer(cls):
+        return BufferDict()
+        
+    def get_key(self,el):
+        return el.__xmlroot__.get('key') or el.__varname__
+        
+    def make_scan(self):
+        sep = self.__xmlroot__.get('sep_regex') or \
+            re.escape(self.__xmlroot__.get('sep') or '=')
+        regex = r'[ \t]*(\S.*?)(?:%s)(.*)'%sep
+        fields = {self.get_key(el):(el.__varname__,el.get_converter()) 
+            for el in self.get_values()}
+        keep = (self.__xmlroot__.get('unknown') or 'keep').lower()=='keep'
+        return keyval_scanner_factory(self.__slot__,regex,fields,keep,
+            get_parser().pp.ParseException) # produce with factory (proper closures!!)
+        
+    def get_type(self):
+        return dict
+        
+    def genval(self,dataiter):
+        data = dataiter.getall()
+        _print('TreeKEYVAL.genval>>>data',data)
+        dataiter.exhaust()
+        if type(data) is not dict:
+            raise GenerationError('%s <> %s for %s'%(dict,type(data),self.__tag__))
+        sep = self.__xmlroot__.get('sep') or '='
+        fields = self.get_fields()
+        buf = [self.__text__] if self.__text__ else []
+        for name,value in data.items():
+            field = fields.get(name)
+            if field is None:
+                buf.append('%s %s %s\n'%(name,sep,value))
+                continue
+            key,type_,check,write,tag = field
+            if type(value) is not type_:
+                raise GenerationError('%s <> %s for %s'%(type_,type(value),tag))
+            if check is not None: check(value)
+            buf.append('%s %s %s\n'%(key,sep,write(value)))
+        return ''.join(buf)
+
+class TreeTABLE(ParsingTreeScanned):
+    """
+    Free-format table: one line per row, fields separated by whitespace 
+    or by the "delimiter" attribute. Children are the value tags of the 
+    columns, in order. The table ends at the first line with another 
+    number of fields or with a field failing to convert.
+    Output modes (attribute "output"):
+        rows    - list of dictionaries, one per row (default)
+        columns - dictionary of typed columns (see make_column)
+    """
+    
+    def __init__(self,xmlroot,parent=None):
+        super().__init__(xmlroot,parent)
+        self.__output__ = (xmlroot.get('output') or 'rows').lower()
+        if self.__output__ not in ('rows','columns'):
+            raise Exception('TABLE tag: unknown output "%s"'%self.__output__)
+    
+    def get_buffer(self):
+        return BufferDict() if self.__output__=='columns' else BufferList()
+        
+    def get_columns(self):
+        """ (name,type,converter) of the columns """
+        columns = []
+        for el in self.get_values():
+            type_ = el.get_type()
+            convert = str.strip if type_ is str else el.get_converter()
+            columns.append((el.__varname__,type_,convert))
+        return columns
+        
+    def make_scan(self):
+        return table_scanner_factory(self.__slot__,self.get_columns(),
+            self.__xmlroot__.get('delimiter'),self.__output__) # produce with factory (proper closures!!)
+        
+    def get_type(self):
+        return dict if self.__output__=='columns' else list
+        
+    def iter_rows(self,data):
+        """ Lines of the table rows """
+        delimiter = self.__xmlroot__.get('delimiter') or ' '
+        fields = self.get_fields().items()
+        for row in data:
+            vals = []
+            for name,(_,type_,check,write,tag) in fields:
+                value = row[name]
+                if type(value) is not type_:
+                    raise GenerationError('%s <> %s for %s'%(type_,type(value),tag))
+                if check is not None: check(value)
+                vals.append(write(value))
+            yield delimiter.join(vals)+'\n'
+        
+    def genval_to(self,dataiter,write):
+        data = dataiter.getall()
+        _print('TreeTABLE.genval_to>>>tag',self.__tag__)
+        dataiter.exhaust()
+        if type(data) is not self.get_type():
+            raise GenerationError('%s <> %s for %s'%(self.get_type(),type(data),self.__tag__))
+        if type(data) is dict: # columns back to rows (field indices stand for positions)
+            data = columns_to_rows(data,[(name,i,i+1,type_,None) 
+                for i,(name,type_,_) in enumerate(self.get_columns())])
+        if self.__text__: write(self.__text__)
+        write_rows(self.iter_rows(data),write)
+        
+    def genval(self,dataiter):
+        chunks = []
+        self.genval_to(dataiter,chunks.append)
+        return ''.join(chunks)
+
 class ffloat(float): 
     """
     Fortran-type float dealing with peculiarities of the Fortran
@@ -1055,16 +2692,263 @@ class ffloat(float):
     def __init__(self,value):
         float.__init__(value)
         
+class LazyRow(Mapping):
+    """
+    FIXCOL row which keeps the raw line and converts the fields 
+    on the first access (converted values are cached).
+    Index is shared by all rows: {name:(i_start,i_end,type,mask)}.
+    """
+    
+    __slots__ = ('__line__','__index__','__cache__')
+    
+    def __init__(self,line,index):
+        self.__line__ = line
+        self.__index__ = index
+        self.__cache__ = {}
+        
+    def __getitem__(self,name):
+        cache = self.__cache__
+        if name in cache:
+            return cache[name]
+        i_start,i_end,type_,mask = self.__index__[name]
+        s = self.__line__[i_start:i_end]
+        try:
+            val = type_(s)
+        except ValueError:
+            if mask is None or s.strip()!=mask:
+                raise
+            val = mask
+        cache[name] = val
+        return val
+        
+    def __iter__(self):
+        return iter(self.__index__)
+        
+    def __len__(self):
+        return len(self.__index__)
+        
+    def __repr__(self):
+        return 'LazyRow(%s)'%repr(self.__line__)
+
+def make_lazy_rows(lines,columns,restofline=None,i_rol=None):
+    """
+    Wrap the raw FIXCOL lines to the lazy rows (no conversion is done).
+    """
+    index = {name:(i_start,i_end,type_,mask) 
+        for name,i_start,i_end,type_,mask in columns}
+    if restofline is not None:
+        index[restofline] = (i_rol,None,str,None)
+    return [LazyRow(line,index) for line in lines]
+
+def project_columns(columns,restofline,names):
+    """
+    Select the requested columns only (names=None selects all).
+    Returns the column tuples and the name of the rest-of-line column.
+    """
+    if names is None:
+        return columns,restofline
+    names = set(names)
+    columns = [col for col in columns if col[0] in names]
+    if restofline not in names: restofline = None
+    return columns,restofline
+
+def convert_fixcol_rows(lines,columns,restofline=None,i_rol=None):
+    """
+    Convert the raw FIXCOL lines to the list of row dictionaries.
+    Columns are the precomputed (name,i_start,i_end,type,mask) tuples.
+    """
+    rows = []
+    append = rows.append
+    for line in lines:
+        item = {}
+        for name,i_start,i_end,type_,mask in columns:
+            s = line[i_start:i_end]
+            try:
+                item[name] = type_(s)
+            except ValueError:
+                if mask is None or s.strip()!=mask:
+                    raise
+                item[name] = mask
+        if restofline is not None:
+            item[restofline] = line[i_rol:]
+        append(item)
+    return rows
+
+def convert_column(strs,type_,mask=None):
+    """
+    Convert the list of raw strings to the list of values.
+    Returns the values and the list of masked flags (None if nothing is masked).
+    Masked values are replaced by NaN (numeric types) or kept as is (strings).
+    """
+    try:
+        return list(map(type_,strs)),None
+    except ValueError:
+        pass
+    values = []; masked = []
+    for s in strs:
+        try:
+            values.append(type_(s)); masked.append(False)
+        except ValueError:
+            if mask is None or s.strip()!=mask:
+                raise
+            values.append(float('nan')); masked.append(True)
+    return values,masked
+
+def make_column(values,masked=None,type_=str):
+    """
+    Create a typed column: NumPy array if NumPy is installed, 
+    array.array or list of strings otherwise.
+    Masked integers become masked NumPy array or array('d') with NaNs.
+    """
+    if type_ in {float,ffloat}:
+        return np.array(values,dtype=float) if np else array('d',values)
+    elif type_ is int:
+        if masked:
+            if np: return np.ma.masked_array(
+                [0 if m else v for v,m in zip(values,masked)],
+                mask=masked,dtype=np.int64)
+            return array('d',values)
+        return np.array(values,dtype=np.int64) if np else array('q',values)
+    else:
+        return np.array(values,dtype=str) if np else values
+
+def convert_fixcol_values(lines,columns,restofline=None,i_rol=None):
+    """
+    Convert the raw FIXCOL lines column by column.
+    Returns the dictionary of (values,masked) pairs, see convert_column.
+    """
+    data = {}
+    for name,i_start,i_end,type_,mask in columns:
+        data[name] = convert_column(
+            [line[i_start:i_end] for line in lines],type_,mask)
+    if restofline is not None:
+        data[restofline] = [line[i_rol:] for line in lines],None
+    return data
+
+def merge_fixcol_values(parts):
+    """
+    Merge the (values,masked) dictionaries converted by different workers.
+    """
+    data = {}
+    for name in parts[0]:
+        values = []; masked = []; is_masked = False
+        for part in parts:
+            vals,msk = part[name]
+            values += vals
+            if msk is None: 
+                masked += [False]*len(vals)
+            else: 
+                masked += msk; is_masked = True
+        data[name] = values,(masked if is_masked else None)
+    return data
+
+def make_fixcol_columns(data,columns,restofline=None):
+    """
+    Create the typed columns from the (values,masked) dictionary.
+    """
+    types = {name:type_ for name,_,_,type_,_ in columns}
+    if restofline is not None: types[restofline] = str
+    return {name:make_column(*data[name],type_=types[name]) for name in data}
+
+def convert_fixcol_columns(lines,columns,restofline=None,i_rol=None):
+    """
+    Convert the raw FIXCOL lines to the dictionary of typed columns.
+    Columns are the precomputed (name,i_start,i_end,type,mask) tuples.
+    """
+    data = convert_fixcol_values(lines,columns,restofline,i_rol)
+    return make_fixcol_columns(data,columns,restofline)
+
+def convert_fixcol_parallel(lines,columns,restofline,i_rol,output,workers):
+    """
+    Split the FIXCOL lines at line boundaries, convert chunks in 
+    the pool of worker processes and merge them back in order.
+    """
+    chunk = -(-len(lines)//workers)
+    chunks = [lines[i:i+chunk] for i in range(0,len(lines),chunk)]
+    func = convert_fixcol_values if output=='columns' else convert_fixcol_rows
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(func,chunks,repeat(columns),
+            repeat(restofline),repeat(i_rol)))
+    if output=='columns':
+        return make_fixcol_columns(merge_fixcol_values(parts),columns,restofline)
+    return [row for part in parts for row in part]
+
+def columns_to_rows(data,columns):
+    """
+    Transpose the dictionary of columns back to the list of rows.
+    NaNs and masked values are replaced by the column masks,
+    integer columns promoted to floats are converted back to integers.
+    """
+    types = {name:(type_,mask) for name,_,_,type_,mask in columns}
+    names = list(data.keys())
+    cols = []
+    for name in names:
+        col = data[name]
+        col = col.tolist() if hasattr(col,'tolist') else list(col)
+        type_,mask = types.get(name,(None,None))
+        if mask is not None:
+            col = [mask if (v is None or v!=v) else v for v in col]
+        if type_ is int:
+            col = [int(v) if type(v) is float else v for v in col]
+        cols.append(col)
+    return [dict(zip(names,vals)) for vals in zip(*cols)]
+
+def masked_writer_factory(write):
+    """ Formatted column writer passing the masked values (strings) as is """
+    def write_masked(value):
+        return value if type(value) is str else write(value)
+    return write_masked
+
+def make_fixcol_writer(HEAD,projection=None,rol_name=None):
+    """
+    Precompute the row template and the column formatters for FIXCOL generation.
+    Returns (template,fields,line_length,rol_name), where fields is a list of 
+    (name,write) pairs filling the template slots.
+    Columns projected out by the markup are baked into template as blanks,
+    the ones missing in the data (projected out by the call) are written
+    as blanks by TreeFIXCOL.iter_rows.
+    """
+    tokens = sorted([t for t in HEAD if 'i_start' in HEAD[t]],
+        key=lambda t: HEAD[t]['i_start'])
+    template = []; fields = []; line_length = 0
+    for token in tokens:
+        col = HEAD[token]
+        length = col['i_end']-col['i_start']
+        line_length += length
+        if projection is not None and col['name'] not in projection:
+            template.append(' '*length)
+            continue
+        template.append('%%%ds'%length)
+        fmt = col.get('format')
+        if fmt:
+            write = masked_writer_factory(
+                Formatter.create_from_format(fmt,col.get('formatter')).write)
+        else:
+            write = str
+        fields.append((col['name'],write))
+    if projection is not None and rol_name not in projection: 
+        rol_name = None
+    return ''.join(template),fields,line_length,rol_name
+
 class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (needs some refactoring!)
     """
     Class for parsing fixed-width fields using Jeanny markup.
+    Output modes (attribute "output"):
+        rows    - list of dictionaries, one per row (default)
+        columns - dictionary of typed columns, one per //HEADER entry 
+        lazy    - list of rows converting the fields on the first access
     """    
 
-    @classmethod
-    def get_buffer(cls):
-        return BufferList()
+    def get_buffer(self):
+        return BufferDict() if self.__output__=='columns' else BufferList()
+        
+    def __init__(self,xmlroot,parent=None):
+        super().__init__(xmlroot,parent)
+        self.__output__ = xmlroot.get('output','rows').lower()
+        if self.__output__ not in {'rows','lazy','columns'}:
+            raise Exception('unknown FIXCOL output: "%s"'%self.__output__)
 
-    def getGrammar(self):
+    def build_grammar(self):
                         
         grammar_body,grammar_tail = self.collect_grammar_fixcol()  # the only difference with ParsingTreeCollection is this line      
         
@@ -1076,7 +2960,8 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
             def move_to_parent(self):
                 parent = self.__parent__ 
                 key = self.__varname__
-                buf = self.__buffer__
+                buffers = LOCAL.context.__buffers__
+                buf = buffers[self.__slot__]
                 _print('============================')
                 _print('move_to_parent>>>self.__tag__',self.__tag__)
                 _print('move_to_parent>>>parent.__tag__',parent.__tag__)
@@ -1084,9 +2969,12 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
                 _print('move_to_parent>>>key',key)
                 _print('move_to_parent>>>buf',buf.__buffer__)
                 _print('============================')
-                parent.__buffer__.relocate_buffer(key,buf)
+                buffers[parent.__slot__].relocate_buffer(key,buf)
             
-            grammar.setParseAction(lambda tokens: move_to_parent(self))
+            if tracing():
+                grammar.setParseAction(lambda tokens: move_to_parent(self))
+            else:
+                grammar.setParseAction(relocation_factory(self))
                 
         _print('ParsingTreeFIXCOL.getGrammar>>>self.__tag__',self.__tag__)
         _print('ParsingTreeFIXCOL.getGrammar>>>self.__varname__',self.__varname__)
@@ -1115,38 +3003,59 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
         //DATA
         0___1___2____.....N______
         
+        Header lines can carry generation options as key=value pairs, e.g.
+        1 Column1 float format=%12.4E
+        2 Column2 float format=(E12.4) formatter=fortranformat
+        
         In the data buffer, comments are marked with hashtag (#) and ignored.
         """
         TYPES = {'float':float,'int':int,'str':str,'ffloat':ffloat}        
                 
         # initialization
         f = io.StringIO(self.__text__)
-        buf = self.__buffer__
+        slot = self.__slot__
                 
-        def trigger_factory(buf,head,restofline):
-            def add_to_buffer(tokens): 
-                line = tokens[0]        
-                item = {}
-                for token in head: 
-                    head_ = head[token]
-                    name = head_['name']
-                    type_ = head_['type']
-                    i_start = head_['i_start']
-                    i_end = head_['i_end']
-                    s = line[i_start:i_end]
-                    try:
-                        val = type_(s)
-                    except ValueError as e:
-                        mask = head_['mask']
-                        if mask is None or s.strip()!=mask:
-                            raise(e)
-                        else:
-                            val = mask
-                    item[name] = val
-                if restofline is not None:
-                    item[restofline] = line[i_end:]
-                buf.insert(None,item)
-            return add_to_buffer
+        def scanner_factory(slot,columns,line_length,restofline,output,varname,projection):
+            i_rol = columns[-1][2] if columns else 0
+            columns,restofline = project_columns(columns,restofline,projection)
+            def scan(instring,loc,doActions=True):
+                # Walk the table block line by line: each row must 
+                # be at least as long as the markup.
+                end = len(instring)
+                lines = []
+                while loc<end:
+                    i = instring.find('\n',loc)
+                    if i<0: i = end
+                    if i-loc<line_length: break
+                    lines.append(instring[loc:i])
+                    loc = i+1
+                if not doActions: 
+                    return min(loc,end),[]
+                context = LOCAL.context
+                buf = context.__buffers__[slot]
+                cols,rol = columns,restofline
+                names = context.__columns__
+                if type(names) is dict: names = names.get(varname)
+                if names is not None:
+                    cols,rol = project_columns(columns,restofline,names)
+                workers = context.__workers__
+                if output=='lazy':
+                    data = make_lazy_rows(lines,cols,rol,i_rol)
+                elif workers and workers>1 and \
+                        len(lines)>=2*VARSPACE['WORKERS_MIN_ROWS']:
+                    workers = min(workers,len(lines)//VARSPACE['WORKERS_MIN_ROWS'])
+                    data = convert_fixcol_parallel(lines,cols,rol,
+                        i_rol,output,workers)
+                elif output=='columns':
+                    data = convert_fixcol_columns(lines,cols,rol,i_rol)
+                else:
+                    data = convert_fixcol_rows(lines,cols,rol,i_rol)
+                if output=='columns':
+                    for name in data: buf.insert(name,data[name])
+                else:
+                    buf.extend(data)
+                return min(loc,end),[]
+            return scan
     
         # Search for //HEADER section.    
         for line in f:
@@ -1160,6 +3069,9 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
             if line[0]=='#': continue
             if '//DATA' in line: break
             vals = [_ for _ in line.split() if _]
+            # split off the key=value options
+            opts = dict(v.split('=',1) for v in vals[2:] if '=' in v)
+            vals = vals[:2]+[v for v in vals[2:] if '=' not in v]
             token = vals[0]
             if token in HEAD:
                 raise Exception('ERROR: duplicate key was found: %s'%vals[0])
@@ -1174,6 +3086,8 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
             except IndexError:
                 mask = None
             HEAD[token]['mask'] = mask                        
+            HEAD[token]['format'] = opts.get('format')
+            HEAD[token]['formatter'] = opts.get('formatter')
             
         # Get tokenized mark-up.
         for line in f:
@@ -1197,42 +3111,27 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
             line_length += i_end-i_start
         #markup = re.findall('([^_]+_*)',widths) # doesn't give indexes
         
-        # create a simpler regular expression
-        regex = '.{%d,}'%line_length
+        # precompute the slicing and conversion tuples
+        columns = [(HEAD[token]['name'],HEAD[token]['i_start'],HEAD[token]['i_end'],
+            HEAD[token]['type'],HEAD[token]['mask']) for token in HEAD]
         
-        #regex = '^' + regex + '$'
-        #regex = '^' + regex
-        _print('collect_grammar_fixcol>>>loop>>regex',regex)
+        _print('collect_grammar_fixcol>>>line_length',line_length)
 
         restofline = self.__xmlroot__.get('restofline')
+        
+        # column projection: only these columns are sliced and converted
+        projection = self.__xmlroot__.get('columns')
+        if projection:
+            projection = [name.strip() for name in projection.split(',')]
             
-        add_to_buffer = trigger_factory(buf,HEAD,restofline) # produce with factory (proper closures!!)        
+        scan = scanner_factory(slot,columns,line_length,restofline,
+            self.__output__,self.__varname__,projection) # produce with factory (proper closures!!)        
         
-        # make a single grammar for body
-        grammar_body = V['PARSER'].Regex(regex)
-
-        grammar_body.setParseAction(add_to_buffer)
+        # make a single native grammar for the whole table body
+        grammar_body = get_parser().Scanner(scan,'FIXCOL').leaveWhitespace()
 
         _print('collect_grammar_fixcol>>>grammar_body',grammar_body)
         
-        if VARSPACE['DEBUG'] and grammar_body: grammar_body.set_debug()
-        
-        # combine grammar body to weed out extra spaces
-        #grammar_body = Combine(grammar_body) 
-        #_print('collect_grammar_fixcol>>>Combine(grammar_body)',grammar_body)
-        
-        #grammar_body = LineStart() + grammar_body + LineEnd()
-        #grammar_body = LineEnd() + grammar_body
-        
-        #grammar_body = grammar_body.leaveWhitespace() # THIS IS NECESSARY!!!
-
-        #grammar_body = ZeroOrMore(LineEnd()+grammar_body).leaveWhitespace()
-        
-        #grammar_body = ZeroOrMore(EOL+grammar_body).leaveWhitespace() # WORKS, BUT NOT WITH LEADING EOLS
-        #grammar_body = ZeroOrMore(EOL) + ZeroOrMore(grammar_body+EOL).leaveWhitespace() # WORKS FOR EOL-UNAWARE PARSING
-        
-        grammar_body = V['PARSER'].ZeroOrMore(grammar_body+V['PARSER'].EOL).leaveWhitespace() # WORKS FOR EOL-AWARE PARSING
-                
         # create a tail grammar, if present
         if self.__tail__ is not None:
             grammar_tail = self.__tail__.strip()
@@ -1244,6 +3143,9 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
         # save for using in generate
         self.__types__ = TYPES
         self.__head__ = HEAD
+        self.__columns__ = columns
+        self.__projection__ = projection
+        self.__writer__ = make_fixcol_writer(HEAD,projection,restofline)
                         
         if VARSPACE['DEBUG'] and grammar_body: grammar_body.set_debug()
                         
@@ -1252,46 +3154,35 @@ class TreeFIXCOL(ParsingTree): # TODO: Make it a child ParsingTreeCollection (ne
     def process(self,grammar_body,grammar_tail):
         return sum_grammars(grammar_body,grammar_tail)
         
-    #def generate(self,data):
-    def genval(self,dataiter):
-        
-        data = dataiter.getall()
-        
-        TYPES = self.__types__
-        HEAD = self.__head__
-        
-        rol_name = self.__xmlroot__.get('restofline')
-        
-        #FORMATS = {str:'%%%ds',int:'%%%dd',float:'%%%de'}
-        
-        tokens = HEAD.keys()
-        names = [HEAD[t]['name'] for t in tokens]
-        
-        buf = ''
+    def iter_rows(self,data):
+        """ Lines of the table rows """
+        template,fields,line_length,rol_name = self.__writer__
         for item in data:
-            vals = [item[name] for name in names]
-            line = ''
-            line_length = 0
-            for val,token in zip(vals,tokens):
-                name = HEAD[token]['name']
-                i_start = HEAD[token]['i_start']
-                i_end = HEAD[token]['i_end']
-                #type_ = TYPES[name]
-                length = i_end-i_start
-                b = '%%%ds'%length%str(val)
-                assert len(b)==length, 'len("%s")=%d!=%d'%(b,len(b),length)
-                buf += b
+            values = [item.get(name) for name,_ in fields]
+            line = template%tuple(['' if value is None else write(value) 
+                for value,(_,write) in zip(values,fields)])
+            assert len(line)==line_length, \
+                'len("%s")=%d!=%d'%(line,len(line),line_length)
             # append comment if any:
             if rol_name is not None:
-                buf += item[rol_name]
-            buf += '\n'
-            
-        if self.__tail__:
-            #tail = process_tail(self.__tail__)
-            _print('TreeFIXCOL.generate>>>process_tail(self.__tail__)',tail,type(tail))
-            buf += tail
+                line += item.get(rol_name) or ''
+            yield line+'\n'
+        
+    def genval_to(self,dataiter,write):
+        
+        data = dataiter.getall()
+        dataiter.exhaust()
+        
+        if type(data) is dict: # columnar output
+            data = columns_to_rows(data,self.__columns__)
             
-        return buf
+        write_rows(self.iter_rows(data),write)
+        
+    #def generate(self,data):
+    def genval(self,dataiter):
+        chunks = []
+        self.genval_to(dataiter,chunks.append)
+        return ''.join(chunks)
 
 class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (needs some refactoring!)
     
@@ -1320,9 +3211,9 @@ class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (ne
                 
         # initialization
         f = io.StringIO(self.__text__)
-        buf = self.__buffer__
+        slot = self.__slot__
                 
-        def trigger_factory(buf,types,masks):
+        def trigger_factory(slot,types,masks):
             def add_to_buffer(tokens):         
                 dct = tokens.as_dict()                
                 #item = {key:types[key](dct[key]) for key in dct} # without exception handling
@@ -1337,7 +3228,7 @@ class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (ne
                         else:
                             val = mask
                     item[key] = val
-                buf.insert(None,item)
+                LOCAL.context.__buffers__[slot].insert(None,item)
             return add_to_buffer
     
         # Search for //HEADER section.    
@@ -1416,15 +3307,15 @@ class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (ne
         if rol_name is not None:
             types[rol_name] = str
             
-        add_to_buffer = trigger_factory(buf,types,masks) # produce with factory (proper closures!!)        
+        add_to_buffer = trigger_factory(slot,types,masks) # produce with factory (proper closures!!)        
         
         # make a single grammar for body
-        grammar_body = V['PARSER'].Regex(regex)
+        grammar_body = get_parser().Regex(regex)
 
         if rol_name is None: # ignore rest of line
-            grammar_body = grammar_body.setParseAction(add_to_buffer) + V['PARSER'].restOfLine()
+            grammar_body = grammar_body.setParseAction(add_to_buffer) + get_parser().restOfLine()
         else:
-            grammar_body = (grammar_body + V['PARSER'].restOfLine(rol_name)).setParseAction(add_to_buffer)
+            grammar_body = (grammar_body + get_parser().restOfLine(rol_name)).setParseAction(add_to_buffer)
 
         _print('collect_grammar_fixcol>>>grammar_body',grammar_body)
         
@@ -1444,7 +3335,7 @@ class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (ne
         #grammar_body = ZeroOrMore(EOL+grammar_body).leaveWhitespace() # WORKS, BUT NOT WITH LEADING EOLS
         #grammar_body = ZeroOrMore(EOL) + ZeroOrMore(grammar_body+EOL).leaveWhitespace() # WORKS FOR EOL-UNAWARE PARSING
         
-        grammar_body = V['PARSER'].ZeroOrMore(grammar_body+V['PARSER'].EOL).leaveWhitespace() # WORKS FOR EOL-AWARE PARSING
+        grammar_body = get_parser().ZeroOrMore(grammar_body+get_parser().EOL).leaveWhitespace() # WORKS FOR EOL-AWARE PARSING
                 
         # create a tail grammar, if present
         if self.__tail__ is not None:
@@ -1457,6 +3348,8 @@ class TreeFIXCOL2(TreeFIXCOL): # TODO: Make it a child ParsingTreeCollection (ne
         # save for using in generate
         self.__types__ = TYPES
         self.__head__ = HEAD
+        self.__projection__ = None
+        self.__writer__ = make_fixcol_writer(HEAD,None,self.__xmlroot__.get('restofline'))
                         
         if VARSPACE['DEBUG'] and grammar_body: grammar_body.set_debug()
                         
@@ -1472,7 +3365,7 @@ class ParsingTreeAux(ParsingTree):
     def get_buffer(cls):
         return BufferStub()
 
-    def getGrammar(self):                
+    def build_grammar(self):
         
         grammar_body,grammar_tail = self.collect_grammar_from_children()
         grammar = self.process(grammar_body,grammar_tail)
@@ -1493,31 +3386,132 @@ class ParsingTreeAux(ParsingTree):
         #return None
         return dataiter        
 
+    def compile_genval(self,plan):
+        # aux tags generate constant text
+        buf = self.genval(None)
+        if buf: plan.emit(OP_TEXT,buf)
+        
+    def compile_enter(self,plan):
+        plan.emit(OP_ENTER_SAME)
+
 class TreeOPTIONAL(ParsingTreeAux):
     
+    __recoverable__ = True # failed generation is not an error
+    
     def process(self,grammar_body,grammar_tail):
-        grammar_body = V['PARSER'].Optional(grammar_body)
+        grammar_body = get_parser().OptionalTransaction(grammar_body,
+            make_predictor(self.get_first_body()))
         return sum_grammars(grammar_body,grammar_tail)
         
+    def get_first(self):
+        first = first_optional(self.get_first_body())
+        return first_sequence([first,first_text(self.__tail__)])
+        
     def handle_generation_error(self):
         _print('TreeOPTIONAL.handle_generation_error')
         pass
 
+class TreeCHOICE(ParsingTreeAux):
+    
+    """
+    Alternatives: the children are tried in turn, the first match wins.
+    If the alternatives start with distinct literals (none is a prefix 
+    of another one), the alternative is picked by its leading literal.
+    Generation takes the first alternative accepting the data and using 
+    all the keys of the data dictionary (if any).
+    """
+    
+    def build_grammar(self):
+        if not self.__children__: raise Exception('CHOICE tag requires'
+            ' at least one alternative')
+        alternatives = [el.getGrammar() for el in self.__children__]
+        predicts = [make_predictor(el.get_first()) for el in self.__children__]
+        grammar = get_parser().Choice(alternatives,self.get_table(),predicts)
+        text = self.__text__.strip() if self.__text__ else None
+        tail = self.__tail__.strip() if self.__tail__ else None
+        grammar = sum_grammars(text,grammar,tail)
+        _print('TreeCHOICE.getGrammar>>>grammar',grammar)
+        
+        if VARSPACE['DEBUG'] and grammar: grammar.set_debug()
+        
+        return grammar
+        
+    def get_table(self):
+        """ Alternative indices by the leading literals, None if not distinct """
+        table = {}
+        for i,el in enumerate(self.__children__):
+            prefix = el.get_prefix()
+            if not prefix or prefix in table or \
+                el.get_first()!=first_text(prefix): return None
+            table[prefix] = i
+        for prefix in table:
+            for prefix_ in table:
+                if prefix!=prefix_ and prefix_.startswith(prefix): return None
+        return table
+        
+    def get_first(self):
+        first = first_union([el.get_first() for el in self.__children__])
+        return first_sequence([first_text(self.__text__),first,first_text(self.__tail__)])
+        
+    def generate_(self,dataiter,sink):
+        _print('TreeCHOICE.generate_>>>dataiter',dataiter)
+        if self.__text__: sink.write(self.__text__)
+        cursor = dataiter.__cursor__
+        for el in self.__children__:
+            savepoint = sink.savepoint()
+            try:
+                dataiter_child = el.dataiter_next(dataiter)
+                el.generate_(dataiter_child,sink)
+                if dataiter_child is not dataiter and dataiter_child.is_unused():
+                    raise GenerationError('unused keys of %s for %s'%(
+                        sorted(dataiter_child.getall()),el.__tag__))
+            except (GenerationError, KeyError):
+                sink.rollback(savepoint)
+                dataiter.__cursor__ = cursor
+                continue
+            sink.release(savepoint)
+            if el.__tail__: sink.write(el.__tail__)
+            return
+        raise GenerationError('no alternative of %s matches the data'%self.__tag__)
+        
+    def compile_plan(self,plan):
+        if plan.__tracing__:
+            plan.emit(OP_TRACE,'GenerationPlan>>>%s(%s)'%(self.__tag__,self.__varname__))
+        if self.__text__: plan.emit(OP_TEXT,self.__text__)
+        jumps = []
+        last = self.__children__[-1]
+        for el in self.__children__:
+            if el is last: 
+                el.compile_child(plan,exhaust=True) # failure of the last one is an error
+                break
+            i_try = plan.emit(OP_CHOICE,None)
+            el.compile_child(plan,exhaust=True)
+            plan.emit(OP_ENDTRY)
+            jumps.append(plan.emit(OP_JUMP,None))
+            plan.patch(i_try,len(plan)) # on failure, go to the next alternative
+        for i_jump in jumps: plan.patch(i_jump,len(plan))
+
 class TreeSOL(ParsingTreeAux):
 
     def process(self,grammar_body,grammar_tail):
         grammar = sum_grammars(grammar_body,grammar_tail)
-        g = V['PARSER'].SOL
+        g = get_parser().SOL
         if grammar: g += grammar
         return g
+        
+    def get_first(self): # zero-width
+        return first_sequence([self.get_first_body(),first_text(self.__tail__)])
 
 class TreeEOF(ParsingTreeAux):
 
     def process(self,grammar_body,grammar_tail):
         grammar = sum_grammars(grammar_body,grammar_tail)
-        g = V['PARSER'].EOF
+        g = get_parser().EOF
         if grammar: g += grammar
         return g
+        
+    def get_first(self):
+        return frozenset([r'\Z']),False
 
 class TreeWhitespace(ParsingTreeAux): # TODO: Similar to TreeEOL. Refactor to a common parent class?
 
@@ -1525,7 +3519,7 @@ class TreeWhitespace(ParsingTreeAux): # TODO: Similar to TreeEOL. Refactor to a
 
     def process(self,grammar_body,grammar_tail):
         grammar = sum_grammars(grammar_body,grammar_tail)
-        g = V['PARSER'].WHITESPACE*self.__nspaces__
+        g = get_parser().WHITESPACE*self.__nspaces__
         if grammar: g += grammar
         return g
     
@@ -1559,9 +3553,9 @@ class TreeWhitespaces(ParsingTreeAux):
         #if not nspaces: raise Exception('Invalid use of n in SS')
         if nspaces:
             nspaces = int(nspaces)
-            g = V['PARSER'].WHITESPACE*nspaces
+            g = get_parser().WHITESPACE*nspaces
         else:
-            g = V['PARSER'].OneOrMore(V['PARSER'].WHITESPACE)
+            g = get_parser().OneOrMore(get_parser().WHITESPACE)
         if grammar: g += grammar
         return g
 
@@ -1608,9 +3602,12 @@ class TreeEOL(ParsingTreeAux):
 
     def process(self,grammar_body,grammar_tail):
         grammar = sum_grammars(grammar_body,grammar_tail)
-        g = V['PARSER'].EOL*self.__neols__
+        g = get_parser().EOL*self.__neols__
         if grammar: g += grammar
         return g
+        
+    def get_first(self):
+        return frozenset([r'\n|\Z']),False
     
     def genval(self,dataiter):
         _print('%s.genval>>>tag'%self.__class__.__name__,self.__tag__)
@@ -1642,11 +3639,14 @@ class TreeEOLS(ParsingTreeAux):
         #if not neols: raise Exception('Invalid use of n in EOLS')
         if neols:
             neols = int(neols)
-            g = V['PARSER'].EOL*neols
+            g = get_parser().EOL*neols
         else:
-            g = V['PARSER'].OneOrMore(V['PARSER'].EOL)
+            g = get_parser().OneOrMore(get_parser().EOL)
         if grammar: g += grammar
         return g
+        
+    def get_first(self):
+        return frozenset([r'\n|\Z']),False
 
     def genval(self,dataiter):
         _print('%s.genval>>>tag'%self.__class__.__name__,self.__tag__)
@@ -1664,7 +3664,7 @@ class TreeSKIPLINE(ParsingTreeAux):
     def process(self,grammar_body,grammar_tail):
         grammar = sum_grammars(grammar_body,grammar_tail)
         #g = SOL+restOfLine+EOL # this should be right???
-        g = V['PARSER'].restOfLine+V['PARSER'].EOL
+        g = get_parser().restOfLine+get_parser().EOL
         if grammar: g += grammar
         return g
 
@@ -1681,7 +3681,7 @@ class TreeSKIPLINES(ParsingTreeAux):
         if not nlines: raise Exception('n empty in SKIPLINES')
         nlines = int(nlines)
         #g = SOL+restOfLine+EOL # this should be right???
-        g = V['PARSER'].restOfLine+V['PARSER'].EOL
+        g = get_parser().restOfLine+get_parser().EOL
         g *= nlines
         if grammar: g += grammar
         return g
@@ -1699,18 +3699,27 @@ class TreeLEAVEWHITESPACE(ParsingTreeAux):
     def process(self,grammar_body,grammar_tail):
         grammar_body = grammar_body.leaveWhitespace()
         return sum_grammars(grammar_body,grammar_tail)
+        
+    def get_first(self):
+        return first_sequence([self.get_first_body(),first_text(self.__tail__)])
 
 class TreeCOMBINE(ParsingTreeAux): 
     
     def process(self,grammar_body,grammar_tail):
-        grammar_body = V['PARSER'].Combine(grammar_body)
+        grammar_body = get_parser().Combine(grammar_body)
         return sum_grammars(grammar_body,grammar_tail)
+        
+    def get_first(self):
+        return first_sequence([self.get_first_body(),first_text(self.__tail__)])
 
 class TreeGROUP(ParsingTreeAux): 
     
     def process(self,grammar_body,grammar_tail):
-        grammar_body = V['PARSER'].Group(grammar_body)
+        grammar_body = get_parser().Group(grammar_body)
         return sum_grammars(grammar_body,grammar_tail)
+        
+    def get_first(self):
+        return first_sequence([self.get_first_body(),first_text(self.__tail__)])
 
 DISPATCHER_TAGS = {
     'FLOAT': TreeFLOAT,
@@ -1722,7 +3731,11 @@ DISPATCHER_TAGS = {
     'DICT': TreeDICT,
     'LIST': TreeLIST,
     'LOOP': TreeLOOP,
+    'KEYVAL': TreeKEYVAL,
+    'TABLE': TreeTABLE,
+    'MATRIX': TreeMATRIX,
     'OPTIONAL': TreeOPTIONAL,
+    'CHOICE': TreeCHOICE,
     'S': TreeWhitespace,
     'S2': TreeWhitespace2,
     'S3': TreeWhitespace3,
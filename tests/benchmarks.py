@@ -0,0 +1,143 @@
+import io
+import argparse
+import pyparsing
+
+from time import time
+from contextlib import redirect_stdout
+
+from freeparse import VARSPACE, Parser, create_from_string
+
+import tests_new
+
+# Switch back to "slow" parser
+parser = Parser(pyparsing)
+VARSPACE['PARSER'] = parser
+print('Switching to',parser.pp.__name__)
+
+SETTINGS = {
+    'scale': 1000,  # multiply each list in the parsed data by this factor
+    'repeat': 3,    # number of parsing repetitions
+    'tags': ['FIXCOL','FIXCOL2'],
+    'trace': False, # build grammars and generation plans with tracing
+    'keep_tokens': False, # build grammars accumulating pyparsing results
+}
+
+def scale_data(data,factor):
+    """ Multiply the lists of the parsed data structure to get a large input """
+    if type(data) is list:
+        return [scale_data(item,1) for item in data]*factor
+    elif type(data) is dict:
+        return {key:scale_data(data[key],factor) for key in data}
+    else:
+        return data
+
+def count_rows(data):
+    """ Count all list items in the parsed data structure """
+    if type(data) is list:
+        return len(data)+sum(count_rows(item) for item in data)
+    elif type(data) is dict:
+        return sum(count_rows(data[key]) for key in data)
+    else:
+        return 0
+
+def timeit(fun,*args):
+    """ Average time of the function call (traced output is swallowed) """
+    t = time()
+    for _ in range(SETTINGS['repeat']):
+        if SETTINGS['trace']:
+            with redirect_stdout(io.StringIO()): 
+                fun(*args)
+        else:
+            fun(*args)
+    return (time()-t)/SETTINGS['repeat']
+
+def do_bench(XML,BUFFER,*args,**kwargs):
+    """ Parse and generate scaled input with all the tag variants, return timings """
+    results = []
+    for tag in SETTINGS['tags']:
+        xml = XML.replace('<FIXCOL ','<%s '%tag).replace('</FIXCOL>','</%s>'%tag)
+        VARSPACE['KEEP_TOKENS'] = SETTINGS['keep_tokens']
+        try:
+            tree = create_from_string(xml)
+            tree.create_grammar()
+            tree.parse_string(BUFFER)
+            data = scale_data(tree.get_data(),SETTINGS['scale'])
+            buf = tree.generate(data)
+            VARSPACE['VERBOSE'] = SETTINGS['trace']
+            t = timeit(tree.parse_string,buf)
+            t_gen = timeit(tree.generate,data)
+        except Exception as e:
+            print('%-8s FAILED: %s'%(tag,e))
+            continue
+        finally:
+            VARSPACE['VERBOSE'] = False
+            VARSPACE['KEEP_TOKENS'] = False
+        nrows = count_rows(tree.get_data())
+        results.append({'tag':tag,'rows':nrows,'time':t,'rows_per_sec':nrows/t,
+            'time_generate':t_gen})
+        print('%-8s rows=%-8d time=%10.6f sec. rows/sec=%12.1f generate=%10.6f sec.'%\
+            (tag,nrows,t,nrows/t,t_gen))
+    return results
+
+BENCH_CASES = [
+    tests_new.test_fixcol,
+    tests_new.test_fixcol_asterisc_1,
+    tests_new.test_fixcol_asterisc_2,
+    tests_new.test_fixcol_asterisc_2_simple1,
+    tests_new.test_fixcol_asterisc_3,
+    tests_new.test_fixcol_fformat,
+]
+
+if __name__=='__main__':
+
+    parser = argparse.ArgumentParser(description=\
+        'Benchmark driver for the FreeParse Python library.')
+
+    parser.add_argument('--scale', type=int, default=SETTINGS['scale'],
+        help='Multiplication factor for the lists in the parsed data')
+
+    parser.add_argument('--repeat', type=int, default=SETTINGS['repeat'],
+        help='Number of parsing repetitions')
+
+    parser.add_argument('--tags', nargs='*', type=str, default=SETTINGS['tags'],
+        help='Tags to substitute for FIXCOL in the test grammars')
+
+    parser.add_argument('--cases', nargs='*', type=str,
+        help='List of test cases (functions from tests_new)')
+
+    parser.add_argument('--all', dest='all',
+        action='store_const', const=True, default=False,
+        help='Run all test cases from tests_new')
+
+    parser.add_argument('--trace', dest='trace',
+        action='store_const', const=True, default=False,
+        help='Build grammars and generation plans with tracing')
+
+    parser.add_argument('--keep-tokens', dest='keep_tokens',
+        action='store_const', const=True, default=False,
+        help='Build grammars keeping the pyparsing results (no suppression)')
+
+    args = parser.parse_args()
+
+    SETTINGS['scale'] = args.scale
+    SETTINGS['repeat'] = args.repeat
+    SETTINGS['tags'] = args.tags
+    SETTINGS['trace'] = args.trace
+    SETTINGS['keep_tokens'] = args.keep_tokens
+
+    # re-use test cases by substituting the test drivers
+    for name in dir(tests_new):
+        if name.startswith('do_test'): setattr(tests_new,name,do_bench)
+
+    if args.all:
+        bench_cases = tests_new.TEST_CASES
+    elif args.cases:
+        bench_cases = [getattr(tests_new,case) for case in args.cases]
+    else:
+        bench_cases = BENCH_CASES
+
+    for bench_fun in bench_cases:
+        print('\n============================================')
+        print(bench_fun.__name__)
+        print('============================================')
+        bench_fun()
@@ -1,14 +1,17 @@
 import os
 import sys
 import json
+import io
 
 import argparse
 import pyparsing
 
 from time import time
+from concurrent.futures import ThreadPoolExecutor
 from jeanny3 import Collection, uuid
 
-from freeparse import ET, ParsingTree, VARSPACE, Parser
+from freeparse import ET, ParsingTree, VARSPACE, Parser, DataIterator, OutputSink, \
+    GenerationError
 
 from unittests import runtest 
 
@@ -172,6 +175,303 @@ def do_test2(XML,BUFFER):
     t = time()-t
     return t,col
 
+def do_test_columns(XML,BUFFER):
+    """ tests for the columnar FIXCOL output: columns are compared
+    with the rows parsed by the same grammar in the default mode,
+    then the rows are re-parsed from the buffer generated from columns """
+    t = time()
+    # parse in both modes
+    tree_columns = ParsingTree.create_tree(ET.fromstring(XML))
+    tree_columns.parse_string(BUFFER)
+    columns = tree_columns.get_data()
+    tree_rows = ParsingTree.create_tree(ET.fromstring(
+        XML.replace('output="columns"','')))
+    tree_rows.parse_string(BUFFER)
+    rows = tree_rows.get_data()
+    print('------------------------------- columns')
+    print(columns)
+    # compare columns with rows, NaNs stand for the masked values
+    data_compare_flag = True
+    for key in columns:
+        if type(rows[key]) is not list: continue
+        for name in columns[key]:
+            col = list(columns[key][name])
+            ref = [row[name] for row in rows[key]]
+            for v,r in zip(col,ref):
+                if v!=r and not (v!=v and type(r) is str):
+                    data_compare_flag = False
+            if len(col)!=len(ref): data_compare_flag = False
+    # generate from columns and parse back
+    rawbuf = tree_columns.generate(columns)
+    print('------------------------------- generated from columns')
+    print(rawbuf)
+    tree_rows.parse_string(rawbuf)
+    data_compare_flag = data_compare_flag and tree_rows.get_data()==rows
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_workers(XML,BUFFER,workers=2):
+    """ tests for the parallel parsing: data parsed by a pool of 
+    worker processes are compared with the data parsed serially """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = json.dumps(parse_tree.get_data(),indent=2,default=lambda obj: obj.tolist())
+    min_rows = VARSPACE['WORKERS_MIN_ROWS']
+    VARSPACE['WORKERS_MIN_ROWS'] = 1
+    try:
+        parse_tree.parse_string(BUFFER,workers=workers)
+    finally:
+        VARSPACE['WORKERS_MIN_ROWS'] = min_rows
+    data_ = json.dumps(parse_tree.get_data(),indent=2,default=lambda obj: obj.tolist())
+    print(data_)
+    data_compare_flag = data==data_
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_lazy(XML,BUFFER):
+    """ tests for the lazy FIXCOL rows: nothing is converted until accessed,
+    then rows are compared with the rows parsed in the default mode """
+    t = time()
+    tree_lazy = ParsingTree.create_tree(ET.fromstring(XML))
+    tree_lazy.parse_string(BUFFER)
+    lazy = tree_lazy.get_data()
+    tree_rows = ParsingTree.create_tree(ET.fromstring(
+        XML.replace('output="lazy"','')))
+    tree_rows.parse_string(BUFFER)
+    rows = tree_rows.get_data()
+    data_compare_flag = True
+    for key in lazy:
+        if type(lazy[key]) is not list: continue
+        for row in lazy[key]:
+            if row.__cache__: data_compare_flag = False
+        print(lazy[key])
+    data_compare_flag = data_compare_flag and lazy==rows
+    # generate from lazy rows and parse back
+    rawbuf = tree_lazy.generate(lazy)
+    tree_rows.parse_string(rawbuf)
+    data_compare_flag = data_compare_flag and tree_rows.get_data()==rows
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_projection(XML,BUFFER,COLUMNS):
+    """ tests for the generation after the call-level column projection:
+    the columns left out are written as blanks, the buffer parsed back
+    with the same projection gives the same data """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    data = parse_tree.parse_string(BUFFER,columns=COLUMNS)
+    print(json.dumps(data,indent=2))
+    rawbuf = parse_tree.generate(data)
+    print(rawbuf)
+    data_compare_flag = parse_tree.parse_string(rawbuf,columns=COLUMNS)==data
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_generate_to(XML,BUFFER):
+    """ tests for the streaming generation: output written to file
+    in small chunks must be the same as the one from generate() """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    rawbuf = parse_tree.generate(data)
+    data_compare_flag = True
+    for chunk_size in [1,16,2**20]:
+        f = io.StringIO()
+        parse_tree.generate_to(f,data,chunk_size=chunk_size)
+        print('chunk_size=%d:'%chunk_size)
+        print(f.getvalue())
+        data_compare_flag = data_compare_flag and f.getvalue()==rawbuf
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_generate_to_flush(XML,BUFFER,chunk_size):
+    """ tests for the streaming generation of large blocks: the output must 
+    be the same as the one from generate(), and it must reach the file in
+    many writes much smaller than the output (no whole-block buffering) """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    rawbuf = parse_tree.generate(data)
+    writes = []
+    class RecordingFile(io.StringIO):
+        def write(self,text):
+            writes.append(len(text))
+            return super().write(text)
+    f = RecordingFile()
+    parse_tree.generate_to(f,data,chunk_size=chunk_size)
+    print('%d chars in %d writes, largest %d'%(len(rawbuf),len(writes),max(writes)))
+    data_compare_flag = f.getvalue()==rawbuf==BUFFER and \
+        len(writes)>2 and max(writes)<len(rawbuf)//2
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_plan(XML,BUFFER):
+    """ tests for the compiled generation plan: output must be the same 
+    as the one of the recursive generate_ method """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    sink = OutputSink()
+    parse_tree.generate_(DataIterator(data),sink)
+    rawbuf = sink.getvalue()
+    print(rawbuf)
+    data_compare_flag = True
+    for _ in range(2): # plan is compiled once and reused
+        data_compare_flag = data_compare_flag and parse_tree.generate(data)==rawbuf
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_handover(XML,BUFFER):
+    """ tests for the buffer relocation: data returned by get_data must 
+    survive the next parsing and be the same as its deep copy """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    data_copy = json.loads(json.dumps(data))
+    print(json.dumps(data,indent=2))
+    parse_tree.parse_string(BUFFER.split('\n',1)[0]+'\n')
+    data_compare_flag = data==data_copy and parse_tree.get_data()!=data
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_data(XML,BUFFER,DATA):
+    """ tests comparing the parsed data structure with the expected one """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    print(json.dumps(data,indent=2))
+    data_compare_flag = data==DATA
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_roundtrip(XML,BUFFER,DATA):
+    """ tests comparing the parsed data with the expected one, then the 
+    buffers generated by generate_ and the plan, then the data parsed back """
+    t = time()
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    print(json.dumps(data,indent=2))
+    sink = OutputSink()
+    parse_tree.generate_(DataIterator(data),sink)
+    rawbuf = parse_tree.generate(data)
+    print(rawbuf)
+    parse_tree.parse_string(rawbuf)
+    data_compare_flag = data==DATA and sink.getvalue()==rawbuf and \
+        parse_tree.get_data()==DATA
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_matrix(XML,BUFFER,DATA):
+    """ tests for the MATRIX tag: matrices (converted to lists) are compared 
+    with the expected ones, then generated and parsed back """
+    t = time()
+    tolist = lambda data: {key:(val.tolist() if hasattr(val,'tolist') else val) 
+        for key,val in data.items()}
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    parse_tree.parse_string(BUFFER)
+    data = parse_tree.get_data()
+    print(json.dumps(tolist(data),indent=2))
+    rawbuf = parse_tree.generate(data)
+    print(rawbuf)
+    parse_tree.parse_string(rawbuf)
+    data_compare_flag = tolist(data)==DATA and tolist(parse_tree.get_data())==DATA
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_matrix_numpy(XML,BUFFER):
+    """ tests for the MATRIX tag with NumPy (skipped without it): arrays 
+    are parsed in both build modes, generated as the nested lists too """
+    t = time()
+    col = Collection()
+    try:
+        import numpy
+    except ImportError:
+        print('NumPy is not installed, skipped')
+        col.update([{'skipped':True}])
+        return time()-t,col
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    data = parse_tree.parse_string(BUFFER)
+    rawbuf = parse_tree.generate(data)
+    lists = {key:val.tolist() for key,val in data.items()}
+    print(rawbuf)
+    verbose = VARSPACE['VERBOSE']
+    VARSPACE['VERBOSE'] = True # tracing build of the grammar
+    try:
+        tree_tracing = ParsingTree.create_tree(ET.fromstring(XML))
+        data_tracing = tree_tracing.parse_string(BUFFER)
+    finally:
+        VARSPACE['VERBOSE'] = verbose
+    data_compare_flag = all(type(val) is numpy.ndarray for val in data.values()) and \
+        {key:val.tolist() for key,val in data_tracing.items()}==lists and \
+        parse_tree.generate(lists)==rawbuf and \
+        {key:val.tolist() for key,val in parse_tree.parse_string(rawbuf).items()}==lists
+    print('data_compare_flag=',data_compare_flag)
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
+def do_test_threads(XML,BUFFERS,nthreads=4):
+    """ tests for one tree shared by the threads: each parse must give
+    the same data as a sequential one, pyparsing defaults must stay intact """
+    t = time()
+    whitespace = pyparsing.ParserElement.DEFAULT_WHITE_CHARS
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    expected = []
+    for buf in BUFFERS:
+        parse_tree.parse_string(buf)
+        expected.append(json.dumps(parse_tree.get_data()))
+    with ThreadPoolExecutor(nthreads) as pool:
+        results = list(pool.map(lambda buf: json.dumps(parse_tree.parse_string(buf)),
+            BUFFERS*nthreads))
+    print(expected)
+    data_compare_flag = results==expected*nthreads and \
+        pyparsing.ParserElement.DEFAULT_WHITE_CHARS==whitespace
+    print('data_compare_flag=',data_compare_flag)
+    col = Collection()
+    col.update([{'data_compare_flag':data_compare_flag}])
+    t = time()-t
+    return t,col
+
 #do_test = do_test1
 do_test = do_test2
 
@@ -1415,7 +1715,7 @@ iso  J     N    mean_res         rms   rms/max_res   max_res<EOL2/>
 3 mean_res FLOAT ************
 4 rms FLOAT ************
 5 rms_to_max_res FLOAT
-6 max_res FLOAT ************
+6 max_res FLOAT ************ format=%12.2f
 
 //DATA
 0_1___2_____3___________4___________5___________6___________
@@ -1482,6 +1782,773 @@ THIS IS A HEADER<EOL2/>
 """
     return do_test(XML,BUFFER)
 
+def test_fixcol_columns():
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="jstat" output="columns" restofline="comment">
+//HEADER
+0 iso INT
+1 J INT ***
+2 name STR
+3 mean_res FLOAT ************
+4 rms FFLOAT
+
+//DATA
+0_1___2_____3___________4___________
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+ 1   0 a         -743.47     4281.70 comment 1
+ 1 *** bc   ************   1.426-100
+ 1   1 def      -4645.41    67444.20
+"""
+    return do_test_columns(XML,BUFFER)
+
+def test_fixcol_workers():
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="jstat" restofline="comment">
+//HEADER
+0 iso INT
+1 J INT
+2 mean_res FLOAT ************
+
+//DATA
+0_1___2___________
+</FIXCOL>
+
+<EOL/>
+
+<FIXCOL name="jstat_columns" output="columns">
+//HEADER
+0 iso INT
+1 J INT
+2 mean_res FLOAT ************
+
+//DATA
+0_1___2___________
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+ 1   0     -743.47
+ 1  40  -141014.20 comment
+ 1   1    -4645.41
+ 1   2   653022.69
+ 1  17    -2742.42
+ 1  18   267588.51
+ 1  22************
+ 1  23   -21084.62
+ 1  24   191513.09
+
+ 1  42  -218612.40
+ 1  45        6.24
+ 1  46  -416568.94
+ 1  47************
+ 1  48  -540608.16
+"""
+    return do_test_workers(XML,BUFFER)
+
+def test_fixcol_projection():
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="parameters" columns="name,estimate,error">
+//HEADER
+0 name STR
+1 R INT
+2 M1 INT
+3 M2 INT
+4 M3 INT
+5 D INT
+6 A1 INT
+7 A2 INT
+8 A3 INT
+9 L INT
+A J INT
+B estimate FLOAT
+C error FLOAT
+D sensit FLOAT
+E est_err FLOAT
+F inflat FLOAT *******
+G weight FLOAT
+H tags STR
+I gradient FLOAT
+J step FLOAT
+
+//DATA
+0_________1_2__3__4__5__6__7__8__9__A__B_________________C________D________E_________F_______G________H__I_________J________
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+ O1        0  0  0  0  0  1  0  0  0  0   1353.674539     0.35E-03 0.42E-09   0.4E+07 ******* 0.55E-01   -0.57E+06  0.14E+04
+ Z1112     0  0  0  0  0  3  1  0  0  0  0.1444336305E-02 0.33E-04 0.20E-10   0.4E+02 6.5E-01 0.71E-01   -0.42E+07  0.14E-02
+ W11122    0  0  0  0  0  3  2  0  0  0 -0.1701685787E-05 0.43E-05 0.45E-11   0.4E+00 ******* 0.60E-04 T  0.85E+07 -0.17E-05
+"""
+    return do_test(XML,BUFFER)
+
+def test_fixcol_projection_call(): # columns given to parse_string, not in the markup
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="table" restofline="comment">
+//HEADER
+0 a INT
+1 b FLOAT
+2 c STR
+
+//DATA
+0___1_______2____
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+   1    1.25 abc   first
+   2   -3.5  de    
+"""
+    return do_test_projection(XML,BUFFER,['a','b'])
+
+def test_fixcol_lazy():
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="jstat" output="lazy" restofline="comment">
+//HEADER
+0 iso INT
+1 J INT
+2 N INT
+3 mean_res FLOAT ************
+4 rms FLOAT ************
+
+//DATA
+0_1___2_____3___________4___________
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+ 1   0    30     -743.47     4281.70
+ 1  40   817  -141014.20  3988600.56 comment
+ 1   1   688    -4645.41************
+ 1   2   609   653022.69 16118126.51
+"""
+    return do_test_lazy(XML,BUFFER)
+
+def test_fixcol_format(): # test per-column formats
+    XML = """
+<DICT>
+
+THIS IS A HEADER<EOL2/>
+
+<FIXCOL name="parameters" restofline="comment">
+//HEADER
+0 i INT format=%3d
+1 x FLOAT format=%12.4E
+2 y FLOAT format=(E12.4) formatter=fortranformat
+
+//DATA
+0__1___________2___________
+</FIXCOL>
+
+</DICT>
+"""
+    BUFFER = """THIS IS A HEADER
+
+  1  1.2345E+00  0.5000E+00
+  2 -3.0000E-05  0.1234E+03 comment
+"""
+    return do_test(XML,BUFFER)
+
+def test_generate_to():
+    XML = """
+<DICT>
+
+*** ITERATIONS ***<EOL/>
+
+<LOOP name="iterations">
+    <DICT>Fnorm=
+        <FLOAT name="Fnorm" format="%11.4E"/> rms=
+        <FLOAT name="rms" format="%8.2f"/> 
+        <OPTIONAL> mu=
+            <FLOAT name="mu" format="%9.1E"/>
+        </OPTIONAL> 
+        <EOL/>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """*** ITERATIONS ***
+Fnorm= 0.1102E+07 rms=    1.83
+Fnorm= 0.1101E+07 rms=    1.82 mu=  1.0E+01
+Fnorm= 0.1100E+07 rms=    1.81
+"""
+    return do_test_generate_to(XML,BUFFER)
+
+def test_generate_to_flush(): # large table in an alternative rolled back after a flush
+    XML = """
+<DICT>
+<LOOP name="blocks">
+<CHOICE>
+<DICT>A<EOL/>
+<FIXCOL name="table">
+//HEADER
+0 i INT
+1 x FLOAT
+
+//DATA
+0_____1_________
+</FIXCOL>
+<INT name="count"/><EOL/>
+</DICT>
+<DICT>B<EOL/>
+<FIXCOL name="table">
+//HEADER
+0 i INT
+1 x FLOAT
+
+//DATA
+0_____1_________
+</FIXCOL>
+</DICT>
+</CHOICE>
+</LOOP>
+</DICT>
+"""
+    BUFFER = 'B\n'+''.join(['%6d%10s\n'%(i,i*0.5) for i in range(5000)])
+    return do_test_generate_to_flush(XML,BUFFER,4096)
+
+def test_generation_plan():
+    XML = """
+<DICT>
+
+*** ITERATIONS ***<EOL/>
+
+<LOOP name="iterations">
+    <DICT>Fnorm=
+        <FLOAT name="Fnorm" format="%11.4E"/> flag=
+        <WORD name="flag" input="YN"/> 
+        <OPTIONAL> mu=
+            <FLOAT name="mu" format="%9.1E"/> 
+            <REGEX name="unit" input="[a-z]+"/>
+        </OPTIONAL> 
+        <EOL/>
+        <LOOP name="inner">
+            <DICT>iter=
+                <INT name="iter" format="%2d"/> 
+            </DICT>
+            <EOL/>
+        </LOOP>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """*** ITERATIONS ***
+Fnorm= 0.1102E+07 flag= Y
+iter= 1
+iter= 2
+Fnorm= 0.1101E+07 flag= N mu=  1.0E+01 cm
+iter= 1
+Fnorm= 0.1100E+07 flag= Y
+"""
+    return do_test_plan(XML,BUFFER)
+
+def test_buffer_handover():
+    XML = """
+<DICT>
+
+*** ITERATIONS ***<EOL/>
+
+<LOOP name="iterations">
+    <DICT>Fnorm=
+        <FLOAT name="Fnorm"/> 
+        <EOL/>
+        <LOOP name="inner">
+            <LIST>iter=
+                <INT/> 
+                <INT/> 
+            </LIST>
+            <EOL/>
+        </LOOP>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """*** ITERATIONS ***
+Fnorm= 0.1102E+07
+iter= 1 2
+iter= 2 3
+Fnorm= 0.1101E+07
+iter= 1 5
+"""
+    return do_test_handover(XML,BUFFER)
+
+def test_optional_rollback(): # partially matched optional must not leave values
+    XML = """
+<DICT>
+
+<LOOP name="items">
+    <DICT>item=
+        <INT name="id"/>
+        <OPTIONAL><FLOAT name="mass"/> kg</OPTIONAL>
+        <RESTOFLINE name="rest"/>
+        <EOL/>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """item= 1 2.5 kg
+item= 2 3.5 m
+item= 3 4.5 kg
+"""
+    DATA = {'items':[
+        {'id':1,'mass':2.5,'rest':''},
+        {'id':2,'rest':'3.5 m'},
+        {'id':3,'mass':4.5,'rest':''},
+    ]}
+    return do_test_data(XML,BUFFER,DATA)
+
+def test_memo_replay(): # memoized header is replayed to the equal entry container
+    XML = """
+<DICT memo="yes">
+
+<LOOP name="blocks">
+    <DICT>
+        <OPTIONAL>
+            <DICT name="header"><WORD name="key"/>=<INT name="value"/><EOL/></DICT><LITERAL name="end" input="END"/><EOL/>
+        </OPTIONAL>
+        <DICT name="entry"><WORD name="key"/>=<INT name="value"/><EOL/></DICT>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """a = 1
+END
+b = 2
+c = 3
+"""
+    DATA = {'blocks':[
+        {'header':{'key':'a','value':1},'end':'END','entry':{'key':'b','value':2}},
+        {'entry':{'key':'c','value':3}},
+    ]}
+    return do_test_data(XML,BUFFER,DATA)
+
+def test_threads(): # one tree parses different inputs in several threads
+    XML = """
+<DICT>
+
+<LOOP name="items">
+    <DICT>item=
+        <INT name="id"/>
+        <OPTIONAL><FLOAT name="mass"/> kg</OPTIONAL>
+        <RESTOFLINE name="rest"/>
+        <EOL/>
+    </DICT>
+</LOOP>
+
+</DICT>
+"""
+    BUFFERS = [
+        ''.join('item= %d %d.5 kg\n'%(i,i) for i in range(2000)),
+        ''.join('item= %d %d.5 m\n'%(i,i) for i in range(1500)),
+        'item= 1 comment\n'*1000,
+    ]
+    return do_test_threads(XML,BUFFERS)
+
+def test_loop_until(): # loops ended by terminators instead of the failed iterations
+    XML = """
+<DICT>
+
+<LOOP name="lines" until="END"><RESTOFLINE/><EOL/></LOOP>END<EOL/>
+<LOOP name="words" until_regex="\\d"><WORD/><EOL/></LOOP>
+<INT name="count"/><EOL/>
+
+</DICT>
+"""
+    BUFFER = """first line
+  second line
+END
+alpha
+beta
+42
+"""
+    DATA = {'lines':['first line','  second line'],'words':['alpha','beta'],'count':42}
+    return do_test_data(XML,BUFFER,DATA)
+
+def test_first_prediction(): # optional blocks and loops skipped by lookahead
+    XML = """
+<DICT>
+
+<LOOP name="atoms" min="1"><LIST>ATOM <WORD/> <FLOAT/> <FLOAT/></LIST><EOL/></LOOP>
+<OPTIONAL><DICT name="charge">CHARGE <INT name="value"/><EOL/></DICT></OPTIONAL>
+<OPTIONAL><DICT name="spin">SPIN <INT name="value"/><EOL/></DICT></OPTIONAL>
+<LOOP name="bonds"><LIST><INT/> - <INT/></LIST><EOL/></LOOP>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """ATOM H 0.0 0.1
+ATOM O 1.0 -.5
+SPIN 2
+  1 - 2
+END
+"""
+    DATA = {'atoms':[['H',0.0,0.1],['O',1.0,-0.5]],'spin':{'value':2},
+        'bonds':[[1,2]]}
+    return do_test_data(XML,BUFFER,DATA)
+
+def test_choice_dispatch(): # alternatives picked by the leading literals
+    XML = """
+<DICT>
+
+<LOOP name="records">
+<CHOICE>
+<DICT>ATOM <WORD name="symbol"/><S/><FLOAT name="x"/><EOL/></DICT>
+<DICT>BOND <INT name="i"/> - <INT name="j"/><EOL/></DICT>
+<DICT>CHARGE <INT name="q"/><EOL/></DICT>
+</CHOICE>
+</LOOP>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """ATOM H 0.5
+BOND 1 - 2
+  CHARGE -1
+ATOM O 1.5
+END
+"""
+    DATA = {'records':[{'symbol':'H','x':0.5},{'i':1,'j':2},{'q':-1},
+        {'symbol':'O','x':1.5}]}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_choice_ordered(): # alternatives without distinct literals are tried in turn
+    XML = """
+<DICT>
+
+<LOOP name="values">
+<CHOICE>
+<FLOAT/>
+<INT/>
+<LIST>( <WORD/><S/><WORD/> )</LIST>
+<WORD/>
+</CHOICE><S/>
+</LOOP>
+<EOL/>
+
+</DICT>
+"""
+    BUFFER = """1 2.5 ( a b ) c 3 
+"""
+    DATA = {'values':[1,2.5,['a','b'],'c',3]}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_choice_shapes(): # alternatives with overlapping key sets
+    XML = """
+<DICT>
+
+<LOOP name="rows">
+<CHOICE>
+<DICT>A <INT name="i"/><EOL/></DICT>
+<DICT>B <INT name="i"/><S/><INT name="j"/><EOL/></DICT>
+</CHOICE>
+</LOOP>
+
+</DICT>
+"""
+    BUFFER = """A 1
+B 2 3
+A 4
+"""
+    DATA = {'rows':[{'i':1},{'i':2,'j':3},{'i':4}]}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_keyval(): # "key = value" sections in arbitrary order
+    XML = """
+<DICT>
+
+*** SETTINGS ***<EOL/>
+<KEYVAL name="settings">
+<INT name="maxiter"/>
+<FLOAT name="tol"/>
+<FLOAT name="energy" key="Total energy"/>
+<STR name="method"/>
+</KEYVAL>
+*** OPTIONS ***<EOL/>
+<KEYVAL name="options" sep=":" unknown="drop">
+<INT name="verbose"/>
+</KEYVAL>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """*** SETTINGS ***
+method = lbfgs
+  Total energy =  -1.5E+02
+tol = 1e-6
+comment = free text = with separators
+maxiter = 100
+*** OPTIONS ***
+output: file.log
+verbose: 2
+END
+"""
+    DATA = {'settings':{'method':'lbfgs','energy':-150.0,'tol':1e-6,
+        'comment':'free text = with separators','maxiter':100},
+        'options':{'verbose':2}}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_keyval_regex(): # separator given by a regex in parsing and by sep in output
+    XML = r"""
+<DICT>
+
+<KEYVAL name="settings" sep_regex=":\s*" sep=":">
+<INT name="a"/>
+</KEYVAL>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """a: 1
+b:x
+END
+"""
+    DATA = {'settings':{'a':1,'b':'x'}}
+    try: # sep_regex without sep cannot be generated
+        ParsingTree.create_tree(ET.fromstring(XML.replace(' sep=":"','')))
+    except Exception as e:
+        print('expected error:',e)
+    else:
+        raise Exception('sep_regex without sep must be rejected')
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_table(): # free-format table parsed outside pyparsing
+    XML = """
+<DICT>
+
+  x       n   label<EOL/>
+<TABLE name="points">
+<FLOAT name="x"/>
+<INT name="n"/>
+<STR name="label"/>
+</TABLE>
+count: <INT name="count"/><EOL/>
+
+</DICT>
+"""
+    BUFFER = """  x       n   label
+ 0.5      1   a
+-1.0D+01  2   b
+ 3.25    -3   c
+count: 3
+"""
+    DATA = {'points':[{'x':0.5,'n':1,'label':'a'},{'x':-10.0,'n':2,'label':'b'},
+        {'x':3.25,'n':-3,'label':'c'}],'count':3}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_table_columns(): # delimited table with the typed columns output
+    XML = """
+<DICT>
+
+<TABLE name="points" delimiter="," output="columns">
+<FLOAT name="x"/>
+<INT name="n"/>
+<STR name="label"/>
+</TABLE>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """0.5,1,first point
+-1.0,2, second
+3.25,-3,c
+END
+"""
+    return do_test_columns(XML,BUFFER)
+
+def test_matrix(): # column-blocked matrices, full and triangular
+    XML = """
+<DICT>
+
+Full matrix:<EOL/>
+<MATRIX name="full" type="int" columns="2"/>
+Lower triangle:<EOL/>
+<MATRIX name="lower" triangle="lower" columns="3"/>
+Upper triangle:<EOL/>
+<MATRIX name="upper" triangle="upper" size="3" columns="2"/>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """Full matrix:
+             1      2
+      1     11     12
+      2     21     22
+      3     31     32
+             3
+      1     13
+      2     23
+      3     33
+Lower triangle:
+             1              2              3
+      1  0.100000D+01
+      2  0.500000D+00   0.200000D+01
+      3 -0.250000D+00   0.750000D+00   0.300000D+01
+      4  0.100000D+00   0.200000D+00   0.300000D+00
+             4
+      4  0.400000D+01
+Upper triangle:
+             1      2
+      1    1.0    2.0
+      2           4.0
+             3
+      1    3.0
+      2    5.0
+      3    6.0
+END
+"""
+    DATA = {
+        'full':[[11,12,13],[21,22,23],[31,32,33]],
+        'lower':[[1.0,0.5,-0.25,0.1],[0.5,2.0,0.75,0.2],[-0.25,0.75,3.0,0.3],
+            [0.1,0.2,0.3,4.0]],
+        'upper':[[1.0,2.0,3.0],[2.0,4.0,5.0],[3.0,5.0,6.0]],
+    }
+    return do_test_matrix(XML,BUFFER,DATA)
+
+def test_matrix_numpy(): # matrices as NumPy arrays
+    XML = """
+<DICT>
+
+<MATRIX name="full" type="int" columns="2"/>
+<MATRIX name="lower" triangle="lower" columns="2"/>
+END<EOL/>
+
+</DICT>
+"""
+    BUFFER = """             1      2
+      1     11     12
+      2     21     22
+      3     31     32
+             3
+      1     13
+      2     23
+      3     33
+             1      2
+      1    1.0
+      2    2.0    3.0
+END
+"""
+    return do_test_matrix_numpy(XML,BUFFER)
+
+def test_loop_count(): # loops repeated by the counts parsed before
+    XML = """
+<DICT>
+
+NATOMS = <INT name="natoms"/><EOL/>
+<LOOP name="atoms" count="@natoms"><LIST><WORD/><S/><FLOAT/></LIST><EOL/></LOOP>
+<LOOP name="ghosts"><LIST><WORD/><S/><FLOAT/></LIST><EOL/></LOOP>
+<DICT name="charges">CHARGES<EOL/>
+<LOOP name="values" count="@natoms"><FLOAT/><EOL/></LOOP>
+</DICT>
+<LOOP name="pair" count="2"><INT/><S/></LOOP><EOL/>
+
+</DICT>
+"""
+    BUFFER = """NATOMS = 2
+H 0.5
+O 1.5
+X 0.0
+CHARGES
+0.4
+-0.4
+1 2 
+"""
+    DATA = {'natoms':2,'atoms':[['H',0.5],['O',1.5]],'ghosts':[['X',0.0]],
+        'charges':{'values':[0.4,-0.4]},'pair':[1,2]}
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_loop_count_memo(): # counted loops reached with different counts at the same place
+    XML = """
+<DICT>
+
+<CHOICE>
+<DICT name="a"><INT name="n"/><S/><INT name="m"/><S/>
+<DICT name="body" memo="yes"><LOOP name="values" count="@n"><INT/><S/></LOOP></DICT><EOL/>
+</DICT>
+<DICT name="b"><INT name="m"/><S/><INT name="n"/><S/>
+<DICT name="body" memo="yes"><LOOP name="values" count="@n"><INT/><S/></LOOP></DICT><EOL/>
+</DICT>
+</CHOICE>
+
+</DICT>
+"""
+    BUFFER = """1 2 5 6 
+"""
+    DATA = {'b':{'m':1,'n':2,'body':{'values':[5,6]}}}
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    try: # the count must match the number of items
+        parse_tree.generate({'b':{'m':1,'n':3,'body':{'values':[5,6]}}})
+    except GenerationError as e:
+        print('expected error:',e)
+    else:
+        raise Exception('count mismatch must not be generated')
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
+def test_text_blocks(): # text blocks closed by the nearest or the nth end
+    XML = """
+<DICT>
+
+<TEXT name="first" begin="BEGIN" end="END"/><EOL/>
+<TEXT name="second" begin="BEGIN" end="END\\d"/><EOL/>
+<TEXT name="nested" begin="\\[" end="]" nth="2" maxlen="40"/><EOL/>
+<TEXT name="last" begin="#" end="#" nth="last"/><EOL/>
+
+</DICT>
+"""
+    BUFFER = """BEGIN a
+b END
+BEGIN c END1
+[ x [ y ] z ]
+# one # two #
+"""
+    DATA = {'first':'BEGIN a\nb END','second':'BEGIN c END1',
+        'nested':'[ x [ y ] z ]','last':'# one # two #'}
+    parse_tree = ParsingTree.create_tree(ET.fromstring(XML))
+    try: # a block which would be scanned back shorter is rejected
+        parse_tree.generate(dict(DATA,first='BEGIN a END b END'))
+    except GenerationError as e:
+        print('expected error:',e)
+    else:
+        raise Exception('block with an inner end must not be generated')
+    return do_test_roundtrip(XML,BUFFER,DATA)
+
 TEST_CASES = [
     test_part0a,
     test_part0b,
@@ -1516,6 +2583,33 @@ TEST_CASES = [
     test_fixcol_asterisc_2_simple1,
     test_fixcol_asterisc_3,
     test_fixcol_fformat,
+    test_fixcol_columns,
+    test_fixcol_workers,
+    test_fixcol_projection,
+    test_fixcol_projection_call,
+    test_fixcol_lazy,
+    test_fixcol_format,
+    test_generate_to,
+    test_generate_to_flush,
+    test_generation_plan,
+    test_buffer_handover,
+    test_optional_rollback,
+    test_memo_replay,
+    test_threads,
+    test_loop_until,
+    test_first_prediction,
+    test_choice_dispatch,
+    test_choice_ordered,
+    test_choice_shapes,
+    test_keyval,
+    test_keyval_regex,
+    test_table,
+    test_table_columns,
+    test_matrix,
+    test_matrix_numpy,
+    test_loop_count,
+    test_loop_count_memo,
+    test_text_blocks,
 ]
 
 def get_test_cases(func_names):